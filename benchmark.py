@@ -0,0 +1,96 @@
+# /benchmark.py
+# Benchmarks / Бенчмарки
+#
+# Run: python benchmark.py [--frames 1000] [--bones 200]
+# Results are printed and appended to bench_output.txt
+
+import argparse
+import time
+from datetime import datetime
+import logging
+
+import core
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+file_id = 'benchmark'
+
+BENCH_OUTPUT = 'bench_output.txt'
+
+
+def make_chain(n_bones, n_frames):
+    # Two chains so look_at/copy have a target on the other side / Две цепочки для целей
+    scene = core.Scene()
+    for side in ('a', 'b'):
+        parent = None
+        for i in range(n_bones // 2):
+            bid = f"{side}{i}"
+            scene.add_bone(bid, parent, x=10.0 if parent else (100.0 if side == 'a' else 300.0), y=0.0,
+                           angle=5.0, length=10.0)
+            parent = bid
+    scene.set_frames({f: {f"a{i}": {"angle": (f + i) % 90} for i in range(0, n_bones // 2, 3)}
+                      for f in range(n_frames)})
+    return scene
+
+
+def timed(fn, repeat=20):
+    fn()  # Warm-up / Прогрев
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_constraints(n_bones, n_frames):
+    """Per-constraint cost of solve_batch over n_frames, by constraint type."""
+    results = []
+    frames = range(n_frames)
+    base_scene = make_chain(n_bones, n_frames)
+    local = base_scene.sample_locals(frames)
+    base = timed(lambda: base_scene.solve_batch(local))
+    results.append(("solve_batch, no constraints", base, None))
+    half = n_bones // 2
+    setups = {
+        'limit': lambda s, i: s.add_constraint(f"a{i}", {"type": "limit", "min": -10.0, "max": 10.0}),
+        'look_at': lambda s, i: s.add_constraint(f"b{i}", {"type": "look_at", "target": f"a{i}"}),
+        'copy': lambda s, i: s.add_constraint(f"b{i}", {"type": "copy", "target": f"a{i}", "x": 2.0}),
+    }
+    for kind, add in setups.items():
+        scene = make_chain(n_bones, n_frames)
+        count = sum(bool(add(scene, i)) for i in range(half))
+        scene.solve_order()
+        spent = timed(lambda: scene.solve_batch(local))
+        results.append((f"solve_batch, {count} x {kind}", spent, (spent - base) / max(count, 1)))
+    return results
+
+
+def bench_pose_sharing(n_bones, n_frames, cycle=30):
+    """solve_frames of a looping animation (interned poses) against solving every frame."""
+    scene = make_chain(n_bones, n_frames)
+    scene.set_frames({f: scene.frames[f % cycle] for f in range(n_frames)})
+    frames = range(n_frames)
+    unique = len({id(p) for p in scene.frames.values()})
+    full = timed(lambda: scene.solve_batch(scene.sample_locals(frames)))
+    shared = timed(lambda: scene.solve_frames(frames))
+    return [("solve every frame", full, None), (f"solve_frames, {unique} distinct poses", shared, None)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bone animation benchmarks")
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--bones', type=int, default=200)
+    args = parser.parse_args()
+    lines = [f"# {datetime.now().isoformat(timespec='seconds')} frames={args.frames} bones={args.bones}"]
+    for name, spent, per in bench_constraints(args.bones, args.frames) + bench_pose_sharing(args.bones, args.frames):
+        extra = f", {per * 1e6:.1f} us per constraint" if per is not None else ""
+        lines.append(f"{name}: {spent * 1e3:.2f} ms{extra}")
+    print("\n".join(lines))
+    with open(BENCH_OUTPUT, 'a', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,106 @@
 # /core.py
 
 from copy import deepcopy
-from typing import Dict
+from typing import Callable, Dict, List, Optional
 import numpy as np
 import logging
 
+import keyreduce
+
 logger = logging.getLogger(__name__)
 
 logger.debug('core.py run')
 file_id = 'core'
 
+CONSTRAINT_TYPES = ('limit', 'look_at', 'copy')
+POSE_POOL_SLACK = 64  # Unused interned poses tolerated before pruning / Допустимо неиспользуемых поз до очистки
+
+
+def pose_key(pose) -> tuple:
+    # Hashable content of a frame pose, empty overrides ignored / Хешируемое содержимое позы кадра
+    return tuple(sorted((bid, tuple(sorted(ch.items()))) for bid, ch in pose.items() if ch))
+
+
+def pack_frames(frames) -> Dict:
+    """File form of frames: every distinct pose once under "poses", frames refer to it by id."""
+    ids, poses, refs = {}, {}, {}
+    for f in sorted(frames):
+        key = pose_key(frames[f])
+        if key not in ids:
+            ids[key] = f"p{len(ids)}"
+            poses[ids[key]] = frames[f]
+        refs[f] = ids[key]
+    return {"poses": poses, "frames": refs}
+
+
+def unpack_frames(state) -> Dict[int, dict]:
+    # References into "poses", or inline poses of older files / Ссылки на "poses" или позы старых файлов
+    poses = state.get("poses")
+    return {int(f): poses[p] if poses is not None else p for f, p in state["frames"].items()}
+
+
+def apply_constraints(constraints, x, y, angle, parent_angle, world):
+    """Run a bone's constraint stack on its world x, y, angle (scalars or per-frame arrays).
+
+    world(bid) gives the already solved (x, y, angle) of a target bone.
+    limit    - clamp the angle relative to the parent to [min, max]
+    look_at  - point the bone at target (+ offset degrees)
+    copy     - take target's position (+ x, y offset in target space) and/or rotation (+ angle)
+    """
+    for c in constraints:
+        kind = c["type"]
+        if kind == 'limit':
+            # Relative angle wrapped to (-180, 180] first / Относительный угол сначала в (-180, 180]
+            rel = 180.0 - (180.0 - (angle - parent_angle)) % 360.0
+            angle = parent_angle + np.clip(rel, c.get("min", -180.0), c.get("max", 180.0))
+        elif kind == 'look_at':
+            tx, ty, _ = world(c["target"])
+            angle = np.degrees(np.arctan2(ty - y, tx - x)) + c.get("offset", 0.0)
+        elif kind == 'copy':
+            tx, ty, ta = world(c["target"])
+            if c.get("position", True):
+                rad = np.radians(ta)
+                dx, dy = c.get("x", 0.0), c.get("y", 0.0)
+                x = tx + dx * np.cos(rad) - dy * np.sin(rad)
+                y = ty + dx * np.sin(rad) + dy * np.cos(rad)
+            if c.get("rotation", True):
+                angle = ta + c.get("angle", 0.0)
+    return x, y, angle
+
+
+def forward_kinematics(local, order, parents, solve_order, active) -> np.ndarray:
+    """Forward kinematics of (F, B, 4) locals laid out in order, vectorized over frames.
+
+    Touches no scene state, so it can run on a worker with inputs captured beforehand.
+    """
+    col = {b: i for i, b in enumerate(order)}
+    out = np.empty_like(local, dtype=float)
+    zero = np.zeros(len(local))
+    for bid in solve_order:
+        i = col[bid]
+        parent = parents[bid]
+        if parent:
+            j = col[parent]
+            pangle = out[:, j, 2]
+            rad = np.radians(pangle)
+            c, s = np.cos(rad), np.sin(rad)
+            x, y = local[:, i, 0], local[:, i, 1]
+            out[:, i, 0] = out[:, j, 0] + x * c - y * s
+            out[:, i, 1] = out[:, j, 1] + x * s + y * c
+            out[:, i, 2] = local[:, i, 2] + pangle
+        else:
+            pangle = zero
+            out[:, i, :3] = local[:, i, :3]
+        if bid in active:
+            out[:, i, 0], out[:, i, 1], out[:, i, 2] = apply_constraints(
+                active[bid], out[:, i, 0], out[:, i, 1], out[:, i, 2], pangle,
+                lambda t: (out[:, col[t], 0], out[:, col[t], 1], out[:, col[t], 2]))
+        out[:, i, 3] = local[:, i, 3]
+    return out
+
+
 class Bone:
-    def __init__(self, id, x=0, y=0, angle=0, length=0, parent=None):
+    def __init__(self, id, x=0, y=0, angle=0, length=0, parent=None, constraints=None):
         logger.info(f'created bone {id} | {file_id}')
         self.id = id
         self.x = float(x)
@@ -19,6 +108,7 @@ class Bone:
         self.angle = float(angle)
         self.length = float(length)
         self.parent = parent
+        self.constraints = list(constraints or [])
 
     def to_dict(self):
         logger.debug(f'bone {self.id} in dict | {file_id}')
@@ -29,32 +119,209 @@ class Bone:
             "angle": self.angle,
             "length": self.length,
             "parent": self.parent,
+            "constraints": deepcopy(self.constraints),
         }
 
 
+class Attachment:
+    """Mesh bound to bones with per-vertex weights (see skinning.py).
+
+    vertices are in scene space at bind time, indices/weights are (N, K) influences
+    into the attachment's own bone palette, bind holds the palette's world
+    (x, y, angle) at bind time.
+    """
+
+    def __init__(self, name, vertices, triangles, bones, indices, weights, bind, color=(90, 140, 220, 255)):
+        logger.info(f'created attachment {name} | {file_id}')
+        self.name = name
+        self.vertices = np.asarray(vertices, dtype=float).reshape(-1, 2)
+        self.triangles = np.asarray(triangles, dtype=int).reshape(-1, 3)
+        self.bones = list(bones)
+        self.indices = np.asarray(indices, dtype=int).reshape(len(self.vertices), -1)
+        self.weights = np.asarray(weights, dtype=float).reshape(self.indices.shape)
+        self.bind = np.asarray(bind, dtype=float).reshape(len(self.bones), 3)
+        self.color = tuple(color)
+
+    def to_dict(self):
+        logger.debug(f'attachment {self.name} in dict | {file_id}')
+        return {
+            "name": self.name,
+            "vertices": self.vertices.tolist(),
+            "triangles": self.triangles.tolist(),
+            "bones": list(self.bones),
+            "indices": self.indices.tolist(),
+            "weights": self.weights.tolist(),
+            "bind": self.bind.tolist(),
+            "color": list(self.color),
+        }
+
+
+class BoneHierarchy:
+    """Children lists, depths and a cached pre-order of the bone tree.
+
+    Children and depths are updated in place on add/remove/reparent; the pre-order
+    (used for solving and subtree ranges) is rebuilt lazily after structural edits.
+    Bones whose parent is missing are treated as roots.
+    """
+
+    def __init__(self):
+        logger.info(f'initialization BoneHierarchy | {file_id}')
+        self.parent: Dict[str, Optional[str]] = {}
+        self.children: Dict[Optional[str], List[str]] = {None: []}
+        self.depth: Dict[str, int] = {}
+        self._order: Optional[List[str]] = None
+        self._index: Dict[str, int] = {}
+        self._size: Dict[str, int] = {}
+        self.revision = 0  # Bumped on every structural change / Растёт при каждом изменении структуры
+
+    def rebuild(self, bones):
+        logger.info(f'rebuild hierarchy | {file_id}')
+        self.revision += 1
+        self.parent = {}
+        self.children = {None: []}
+        for bid in bones:
+            self.children.setdefault(bid, [])
+        for bid, b in bones.items():
+            parent = b.parent if b.parent in bones and b.parent != bid else None
+            if b.parent and parent is None:
+                logger.warning(f'bone {bid} has missing parent {b.parent}, treated as root | {file_id}')
+            self.parent[bid] = parent
+            self.children[parent].append(bid)
+        self._order = None
+        # Bones caught in a parent cycle are unreachable from the roots, detach one per cycle
+        while len(self.order()) < len(self.parent):
+            bid = next(b for b in self.parent if b not in self._index)
+            logger.warning(f'bone {bid} is in a parent cycle, treated as root | {file_id}')
+            self.children[self.parent[bid]].remove(bid)
+            self.parent[bid] = None
+            self.children[None].append(bid)
+            self._order = None
+
+    def __contains__(self, bid):
+        return bid in self.parent
+
+    def add(self, bid, parent=None):
+        logger.debug(f'hierarchy add {bid} under {parent} | {file_id}')
+        self.revision += 1
+        self.parent[bid] = parent
+        self.children.setdefault(bid, [])
+        self.children[parent].append(bid)
+        self.depth[bid] = self.depth[parent] + 1 if parent else 0
+        self._order = None
+
+    def is_ancestor(self, anc, bid):
+        # O(depth) walk up from bid / Проход вверх от bid
+        while bid is not None:
+            if bid == anc:
+                return True
+            bid = self.parent.get(bid)
+        return False
+
+    def subtree(self, bid) -> List[str]:
+        """bid and all of its descendants in pre-order, O(subtree)."""
+        result = []
+        stack = [bid]
+        while stack:
+            cur = stack.pop()
+            result.append(cur)
+            stack.extend(reversed(self.children.get(cur, [])))
+        return result
+
+    def remove_subtree(self, bid) -> List[str]:
+        logger.debug(f'hierarchy remove subtree {bid} | {file_id}')
+        self.revision += 1
+        removed = self.subtree(bid)
+        self.children[self.parent[bid]].remove(bid)
+        for r in removed:
+            del self.parent[r]
+            del self.children[r]
+            self.depth.pop(r, None)
+        self._order = None
+        return removed
+
+    def reparent(self, bid, new_parent):
+        logger.debug(f'hierarchy reparent {bid} to {new_parent} | {file_id}')
+        self.revision += 1
+        self.children[self.parent[bid]].remove(bid)
+        self.parent[bid] = new_parent
+        self.children[new_parent].append(bid)
+        base = self.depth[new_parent] + 1 if new_parent else 0
+        shift = base - self.depth.get(bid, 0)
+        if shift:
+            for r in self.subtree(bid):
+                self.depth[r] = self.depth.get(r, 0) + shift
+        self._order = None
+
+    def order(self) -> List[str]:
+        """Topological (pre-order) solve order, parents before children."""
+        if self._order is None:
+            order = []
+            self._index = {}
+            self._size = {}
+            self.depth = {}
+            stack = [(r, 0) for r in reversed(self.children[None])]
+            while stack:
+                bid, d = stack.pop()
+                self._index[bid] = len(order)
+                self.depth[bid] = d
+                order.append(bid)
+                stack.extend((c, d + 1) for c in reversed(self.children[bid]))
+            for bid in reversed(order):
+                self._size[bid] = 1 + sum(self._size[c] for c in self.children[bid])
+            self._order = order
+            logger.debug(f'hierarchy order rebuilt, {len(order)} bones | {file_id}')
+        return self._order
+
+    def subtree_range(self, bid):
+        """(start, end) slice of order() covering the subtree of bid."""
+        self.order()
+        start = self._index[bid]
+        return start, start + self._size[bid]
+
+
 class Scene:
     def __init__(self):
         logger.info(f'initialization Scene | {file_id}')
         self.bones: Dict[str, Bone] = {}
-        self.frames: Dict[int, Dict[str, Dict[str, float]]] = {0: {}}
+        self.hierarchy = BoneHierarchy()
+        self.attachments: Dict[str, Attachment] = {}
+        self.constraint_revision = 0
+        self._solve_key = None
+        self._solve_order: List[str] = []
+        self._active_constraints: Dict[str, list] = {}
+        self._solve_deps: Dict[str, list] = {}
+        # Frame poses are interned: identical poses are one shared dict, never edited in place
+        # Позы кадров интернированы: одинаковые позы - один общий словарь, не изменяемый на месте
+        self._poses: Dict[tuple, Dict[str, Dict[str, float]]] = {(): {}}
+        self._pose_cache: Dict[int, tuple] = {}
+        self.frames: Dict[int, Dict[str, Dict[str, float]]] = {0: self._poses[()]}
+        # Sparse keys per bone channel, interpolated between frame overrides / Разреженные ключи каналов
+        self.curves: Dict[str, Dict[str, list]] = {}
         self.name = "unnamed"
         self.undo_stack = []
         self.redo_stack = []
         self.cache: Dict[int, Dict[str, tuple]] = {}
+        # Edit counters: whole scene and per frame / Счётчики правок: вся сцена и отдельные кадры
+        self.revision = 0
+        self.base_revision = 0
+        self.frame_revisions: Dict[int, int] = {}
 
     def snapshot(self):
         logger.info(f'create scene snapshot | {file_id}')
-        return deepcopy({
+        state = deepcopy({
             "bones": {k: v.to_dict() for k, v in self.bones.items()},
-            "frames": deepcopy(self.frames),
+            "curves": self.curves,
             "name": self.name,
+            "attachments": {k: v.to_dict() for k, v in self.attachments.items()},
         })
+        # Poses are shared with the scene, they are never edited / Позы общие со сценой, они не изменяются
+        state["frames"] = dict(self.frames)
+        return state
 
     def push_undo(self):
         logger.info(f'push undo scene | {file_id}')
         self.undo_stack.append(self.snapshot())
         self.redo_stack.clear()
-        self.clear_cache()
 
     def undo(self):
         logger.info(f'undo to scene | {file_id}')
@@ -77,80 +344,341 @@ class Scene:
     def _restore(self, state):
         logger.info(f'restore state scene | {file_id}')
         self.bones = {k: Bone(**v) for k, v in state["bones"].items()}
-        self.frames = state["frames"]
+        self.set_frames(unpack_frames(state))
+        self.curves = state.get("curves", {})
         self.name = state.get("name", "unnamed")
+        self.attachments = {k: Attachment(**v) for k, v in state.get("attachments", {}).items()}
+        self.rebuild_hierarchy()
         self.clear_cache()
 
+    def rebuild_hierarchy(self):
+        logger.info(f'rebuild scene hierarchy | {file_id}')
+        self.hierarchy.rebuild(self.bones)
+
+    def intern_pose(self, pose: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+        """Shared copy of pose; a pose passed in is owned by the scene and must not be edited after."""
+        key = pose_key(pose)
+        shared = self._poses.get(key)
+        if shared is None:
+            shared = self._poses[key] = pose if all(pose.values()) else {b: ch for b, ch in pose.items() if ch}
+        return shared
+
+    def set_frames(self, frames):
+        # Replaces all frames, identical poses become one dict / Замена всех кадров, одинаковые позы объединяются
+        self._poses = {(): {}}
+        self.frames = {int(f): self.intern_pose(p) for f, p in frames.items()}
+        live = {id(p) for p in self.frames.values()}
+        self._pose_cache = {k: v for k, v in self._pose_cache.items() if k in live}
+
     def clear_cache(self):
         logger.info(f'clear cache | {file_id}')
         self.cache = {}
+        self._pose_cache = {}
+        self.revision += 1
+        self.base_revision = self.revision
+        self.frame_revisions = {}
+
+    def touch_frames(self, frames):
+        # Invalidate only the given frames / Сброс только указанных кадров
+        logger.debug(f'touch frames {frames} | {file_id}')
+        self.revision += 1
+        for f in frames:
+            self.cache.pop(f, None)
+            self.frame_revisions[f] = self.revision
+
+    def frame_revision(self, frame_idx: int) -> int:
+        return max(self.base_revision, self.frame_revisions.get(frame_idx, 0))
 
     def compute_abs_positions(self, frame_idx: int) -> Dict[str, tuple]:
         logger.info(f'calculating positions for a frame {frame_idx} | {file_id}')
         if frame_idx in self.cache:
             return self.cache[frame_idx]
+        # Without curves, frames sharing a pose share positions / Без кривых кадры с общей позой имеют общие позиции
+        pose = self.frames.get(frame_idx)
+        shared = pose is not None and not self.curves
+        if shared:
+            hit = self._pose_cache.get(id(pose))
+            if hit is not None and hit[0] is pose:
+                self.cache[frame_idx] = hit[1]
+                return hit[1]
 
         abs_pos = {}
+        parents = self.hierarchy.parent
+        active = self.active_constraints()
 
-        def get_bone_state(bid):
-            b = self.bones[bid]
-            overrides = self.frames.get(frame_idx, {}).get(bid, {})
-            return {
-                "x": overrides.get("x", b.x),
-                "y": overrides.get("y", b.y),
-                "angle": overrides.get("angle", b.angle),
-                "length": overrides.get("length", b.length),
-                "parent": b.parent
-            }
-
-        def compute(bid):
-            if bid in abs_pos:
-                return abs_pos[bid]
-            bs = get_bone_state(bid)
-            if bs['parent']:
-                px, py, pangle = compute(bs['parent'])[:3]
+        # Parents and constraint targets come first / Родители и цели ограничений идут раньше
+        for bid in self.solve_order():
+            x, y, angle, length = self.local_values(frame_idx, bid)
+            parent = parents[bid]
+            if parent:
+                px, py, pangle = abs_pos[parent][:3]
                 rad = np.radians(pangle)
-                ax = px + bs['x'] * np.cos(rad) - bs['y'] * np.sin(rad)
-                ay = py + bs['x'] * np.sin(rad) + bs['y'] * np.cos(rad)
-                aangle = bs['angle'] + pangle
+                ax = px + x * np.cos(rad) - y * np.sin(rad)
+                ay = py + x * np.sin(rad) + y * np.cos(rad)
+                aangle = angle + pangle
             else:
-                ax, ay, aangle = bs['x'], bs['y'], bs['angle']
-            alength = bs['length']
-            abs_pos[bid] = (ax, ay, aangle, alength)
-            return ax, ay, aangle, alength
+                ax, ay, aangle, pangle = x, y, angle, 0.0
+            if bid in active:
+                ax, ay, aangle = apply_constraints(active[bid], ax, ay, aangle, pangle, lambda t: abs_pos[t][:3])
+            abs_pos[bid] = (ax, ay, aangle, length)
 
-        for bid in self.bones:
-            compute(bid)
         self.cache[frame_idx] = abs_pos
+        if shared:
+            self._pose_cache[id(pose)] = (pose, abs_pos)
         return abs_pos
 
+    def sample_locals(self, frame_ids, bone_ids=None) -> np.ndarray:
+        """Local (x, y, angle, length) of bone_ids (default: hierarchy order) for all frames, (F, B, 4)."""
+        logger.info(f'sample locals for {len(frame_ids)} frames | {file_id}')
+        bone_ids = self.hierarchy.order() if bone_ids is None else bone_ids
+        # Only rest channels are read, no full to_dict copies / Читаются только каналы покоя
+        data = {"bones": {b: {c: getattr(self.bones[b], c) for c in keyreduce.CHANNELS} for b in bone_ids},
+                "frames": self.frames, "curves": self.curves}
+        values = keyreduce.sample_channels(data, list(frame_ids))[0]
+        return values.reshape(len(frame_ids), len(bone_ids), len(keyreduce.CHANNELS))
+
+    def solve_batch(self, local: np.ndarray) -> np.ndarray:
+        """Forward kinematics of (F, B, 4) locals, vectorized over frames.
+
+        Bones are laid out in hierarchy.order(), they are solved in solve_order().
+        """
+        logger.info(f'solve batch of {len(local)} frames | {file_id}')
+        return forward_kinematics(local, self.hierarchy.order(), self.hierarchy.parent, self.solve_order(),
+                                  self.active_constraints())
+
+    def solve_order(self) -> List[str]:
+        """Hierarchy order extended so constraint targets are solved before their users."""
+        key = (self.hierarchy.revision, self.constraint_revision)
+        if key == self._solve_key:
+            return self._solve_order
+        order = self.hierarchy.order()
+        deps = {b: ([self.hierarchy.parent[b]] if self.hierarchy.parent[b] else []) for b in order}
+        active = {}
+        for bid in order:
+            for c in self.bones[bid].constraints:
+                # Constraints loaded from files get the same checks as add_constraint / Те же проверки
+                target = self._constraint_target(c)
+                if not self._valid_constraint(bid, c) or (target is not None and self._depends_on(deps, target, bid)):
+                    logger.warning(f'constraint {c.get("type")} of {bid} on {target} ignored | {file_id}')
+                    continue
+                active.setdefault(bid, []).append(c)
+                if target is not None:
+                    deps[bid].append(target)
+        # Depth-first topological sort, stable w.r.t. hierarchy order / Топологическая сортировка
+        result, done = [], set()
+        for root in order:
+            stack = [(root, False)]
+            while stack:
+                bid, expanded = stack.pop()
+                if bid in done:
+                    continue
+                if expanded:
+                    done.add(bid)
+                    result.append(bid)
+                    continue
+                stack.append((bid, True))
+                stack.extend((d, False) for d in reversed(deps[bid]) if d not in done)
+        self._solve_order = result
+        self._solve_deps = deps
+        self._active_constraints = active
+        self._solve_key = key
+        logger.debug(f'solve order rebuilt, {len(active)} constrained bones | {file_id}')
+        return result
+
+    @staticmethod
+    def _depends_on(deps, bid, other):
+        # True if solving bid needs other first / True, если для bid нужен other
+        stack, seen = [bid], set()
+        while stack:
+            cur = stack.pop()
+            if cur == other:
+                return True
+            if cur not in seen:
+                seen.add(cur)
+                stack.extend(deps.get(cur, ()))
+        return False
+
+    @staticmethod
+    def _constraint_target(constraint):
+        # limit has no target / У limit нет цели
+        return None if constraint.get("type") == 'limit' else constraint.get("target")
+
+    def _valid_constraint(self, bid, constraint) -> bool:
+        # Known type and, for look_at/copy, an existing target other than bid / Известный тип и цель
+        if constraint.get("type") not in CONSTRAINT_TYPES:
+            return False
+        target = self._constraint_target(constraint)
+        return constraint["type"] == 'limit' or (target in self.bones and target != bid)
+
+    def active_constraints(self) -> Dict[str, list]:
+        self.solve_order()
+        return self._active_constraints
+
+    def dependencies(self) -> Dict[str, list]:
+        # Parent plus active constraint targets of every bone / Родитель и активные цели каждой кости
+        self.solve_order()
+        return self._solve_deps
+
+    def add_constraint(self, bid: str, constraint: Dict) -> bool:
+        logger.info(f'add constraint {constraint} to {bid} | {file_id}')
+        target = self._constraint_target(constraint)
+        if bid not in self.bones or not self._valid_constraint(bid, constraint):
+            logger.warning(f'bad constraint {constraint} for {bid}: unknown type or target | {file_id}')
+            return False
+        if target is not None and self._depends_on(self.dependencies(), target, bid):
+            # Target already depends on bid, the constraint would make a cycle / Цикл зависимостей
+            logger.warning(f'constraint on {target} rejected: cycle | {file_id}')
+            return False
+        self.bones[bid].constraints.append(dict(constraint))
+        self.constraint_revision += 1
+        self.clear_cache()
+        return True
+
+    def clear_constraints(self, bid: str):
+        logger.info(f'clear constraints of {bid} | {file_id}')
+        if bid in self.bones and self.bones[bid].constraints:
+            self.bones[bid].constraints = []
+            self.constraint_revision += 1
+            self.clear_cache()
+
+    def solve_frames(self, frame_ids) -> np.ndarray:
+        """Solved (F, B, 4) world positions of frame_ids, bones in hierarchy.order()."""
+        return self.solve_frames_later(frame_ids)()
+
+    def solve_frames_later(self, frame_ids) -> Callable[[], np.ndarray]:
+        """Sample frame_ids now, return a function solving them that is safe to call on a worker."""
+        frame_ids = list(frame_ids)
+        first, index = frame_ids, None
+        if not self.curves:
+            # Each distinct pose is solved once / Каждая различная поза решается один раз
+            slots, first, index = {}, [], []
+            for f in frame_ids:
+                key = id(self.frames.get(f))
+                if key not in slots:
+                    slots[key] = len(first)
+                    first.append(f)
+                index.append(slots[key])
+            if len(first) == len(frame_ids):
+                index = None
+        local = self.sample_locals(first)
+        # Parents are edited in place, the other inputs are replaced on change / parent меняется на месте
+        inputs = (self.hierarchy.order(), dict(self.hierarchy.parent), self.solve_order(), self.active_constraints())
+
+        def solve():
+            solved = forward_kinematics(local, *inputs)
+            return solved if index is None else solved[index]
+
+        return solve
+
+    def local_values(self, frame_idx: int, bid: str) -> tuple:
+        # Frame override, then curve key interpolation, then bone rest value
+        # Override кадра, затем интерполяция кривой, затем значение кости
+        b = self.bones[bid]
+        overrides = self.frames.get(frame_idx, {}).get(bid, {})
+        curves = self.curves.get(bid)
+        values = []
+        for c in keyreduce.CHANNELS:
+            v = overrides.get(c)
+            if v is None and curves and c in curves:
+                v = keyreduce.curve_value(curves[c], frame_idx)
+            values.append(getattr(b, c) if v is None else v)
+        return tuple(values)
+
+    def reduce_keys(self, pos_tol=0.5, angle_tol=0.5) -> Dict[str, float]:
+        logger.info(f'reduce scene keys | {file_id}')
+        data = {"bones": {k: v.to_dict() for k, v in self.bones.items()}, "frames": self.frames,
+                "curves": self.curves}
+        stats = keyreduce.reduce_keys(data, pos_tol, angle_tol)
+        self.set_frames(self.frames)
+        self.clear_cache()
+        return stats
+
     def to_dict(self):
         logger.info(f'scene to dict | {file_id}')
         return {
             "name": self.name,
             "bones": {k: v.to_dict() for k, v in self.bones.items()},
-            "frames": deepcopy(self.frames),
+            "frames": dict(self.frames),
+            "curves": deepcopy(self.curves),
+            "attachments": {k: v.to_dict() for k, v in self.attachments.items()},
         }
 
     def add_frame(self):
         logger.info(f'add frame to scene | {file_id}')
         idx = max(self.frames.keys()) + 1
-        self.frames[idx] = {}
+        self.frames[idx] = self.intern_pose({})
         return idx
 
     def update_frame_bone(self, frame_idx: int, bid: str, updates: Dict[str, float]):
         logger.debug(f'update bone {bid} on frame {frame_idx} | {file_id}')
-        if frame_idx not in self.frames:
-            self.frames[frame_idx] = {}
-        if bid not in self.frames[frame_idx]:
-            self.frames[frame_idx][bid] = {}
-        self.frames[frame_idx][bid].update(updates)
+        # Copy-on-write: the pose may be shared with other frames and undo states
+        # Копирование при записи: поза может быть общей с другими кадрами и состояниями отмены
+        pose = self.frames.get(frame_idx, {})
+        self.frames[frame_idx] = self.intern_pose({**pose, bid: {**pose.get(bid, {}), **updates}})
+        if len(self._poses) > 2 * len(self.frames) + POSE_POOL_SLACK:
+            self.set_frames(self.frames)
+        self.touch_frames([frame_idx])
+
+    def add_bone(self, bid: str, parent: Optional[str] = None, **kwargs) -> bool:
+        logger.info(f'add bone {bid} with parent {parent} | {file_id}')
+        parent = parent or None
+        if not bid or bid in self.bones:
+            logger.warning(f'bone {bid} already exists or empty id | {file_id}')
+            return False
+        if parent is not None and parent not in self.bones:
+            logger.warning(f'parent {parent} of bone {bid} not found | {file_id}')
+            return False
+        self.bones[bid] = Bone(id=bid, parent=parent, **kwargs)
+        self.hierarchy.add(bid, parent)
         self.clear_cache()
+        return True
+
+    def reparent_bone(self, bid: str, parent: Optional[str]) -> bool:
+        logger.info(f'reparent bone {bid} to {parent} | {file_id}')
+        parent = parent or None
+        if bid not in self.bones or (parent is not None and parent not in self.bones):
+            logger.warning(f'reparent {bid} to {parent}: bone not found | {file_id}')
+            return False
+        if parent is not None and (self.hierarchy.is_ancestor(bid, parent)
+                                   or self._depends_on(self.dependencies(), parent, bid)):
+            # Parent chain or constraint targets of parent lead back to bid / Цикл через родителей или цели
+            logger.warning(f'reparent {bid} to {parent} rejected: cycle | {file_id}')
+            return False
+        self.bones[bid].parent = parent
+        self.hierarchy.reparent(bid, parent)
+        self.clear_cache()
+        return True
+
+    def children(self, bid: Optional[str]) -> List[str]:
+        return list(self.hierarchy.children.get(bid, []))
+
+    def subtree(self, bid: str) -> List[str]:
+        return self.hierarchy.subtree(bid)
 
     def delete_bone(self, bid: str):
         logger.info(f'delete bone {bid} | {file_id}')
         if bid in self.bones:
-            del self.bones[bid]
-            for f in self.frames.values():
-                f.pop(bid, None)
-            self.clear_cache()
\ No newline at end of file
+            # Children are deleted with their parent / Дочерние кости удаляются вместе с родителем
+            removed = self.hierarchy.remove_subtree(bid)
+            for r in removed:
+                del self.bones[r]
+            gone = set(removed)
+            stripped = {}
+            for f, pose in self.frames.items():
+                if not gone.isdisjoint(pose):
+                    if id(pose) not in stripped:
+                        stripped[id(pose)] = {k: v for k, v in pose.items() if k not in gone}
+                    self.frames[f] = stripped[id(pose)]
+            self.set_frames(self.frames)
+            for r in removed:
+                self.curves.pop(r, None)
+            for b in self.bones.values():
+                if any(c.get("target") in gone for c in b.constraints):
+                    b.constraints = [c for c in b.constraints if c.get("target") not in gone]
+                    self.constraint_revision += 1
+            for name in [k for k, a in self.attachments.items() if set(a.bones) & set(removed)]:
+                logger.info(f'attachment {name} removed with its bones | {file_id}')
+                del self.attachments[name]
+            self.clear_cache()
+            return removed
+        return []
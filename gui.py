@@ -2,7 +2,7 @@
 # GUI setup and management / Настройка и управление GUI
 
 import asyncio
-from time import process_time_ns
+from time import process_time_ns, perf_counter
 
 import dearpygui.dearpygui as dpg
 import numpy as np
@@ -11,17 +11,30 @@ import json
 import logging
 import platform  # Добавлен для автоматической загрузки шрифта
 
+import skinning
+import core
+import retime
+import spatial
+import thumbnails
+import uimodel
+
 logger = logging.getLogger(__name__)
 
 logger.debug('gui.py run')
 file_id = 'gui'
 
+PICK_RADIUS = 8.0  # Click tolerance in drawlist pixels / Допуск клика в пикселях
+THUMB_SLOTS = 8  # Visible timeline thumbnails / Видимые миниатюры таймлайна
+TREE_ROWS = 14  # Drawn rows of the bone tree / Отрисованные строки дерева костей
+
 def setup_gui(scene, storage, render):
     logger.info(f'setup GUI | {file_id}')
     # Global variables for GUI / Глобальные переменные для GUI
     state = {
         'current_frame': 0,
         'selected_bone': None,
+        'selected_bones': set(),  # Membership is tested per bone on every redraw / Проверяется на каждой отрисовке
+        'drag_start': None,
         'tool_mode': "select",
         'playing': False,
         'fps': 12,
@@ -30,6 +43,12 @@ def setup_gui(scene, storage, render):
         'onion_alpha': 0.3,
         'positions': {},
         'job_status': "",
+        'io_tasks': [],  # (future, on_done) of running storage jobs / Фоновые задачи хранения
+        'io_progress': 0.0,
+        'io_max_frame_ms': 0.0,
+        'last_frame': 0,
+        'thumb_offset': 0,
+        'thumb_slots': [None] * THUMB_SLOTS,  # (frame, revision) shown in each slot / Что показано в слоте
         'language': 'ru',  # By default Russian / По умолчанию русский
         'translations': {}  # Dictionary of translations / Словарь переводов
     }
@@ -67,6 +86,13 @@ def setup_gui(scene, storage, render):
         dpg.set_item_label("save_name_xml", t('save_as_xml'))
         dpg.set_item_label("save_xml_btn", t('save_xml'))
         dpg.set_item_label("load_xml_combo", t('load_xml'))
+        dpg.set_item_label("reduce_on_save_cb", t('reduce_on_save'))
+        dpg.set_item_label("reduce_pos_tol", t('reduce_pos_tol'))
+        dpg.set_item_label("reduce_angle_tol", t('reduce_angle_tol'))
+        dpg.set_item_label("reduce_keys_btn", t('reduce_keys'))
+        dpg.set_item_label("export_width", t('export_width'))
+        dpg.set_item_label("export_height", t('export_height'))
+        dpg.set_item_label("export_ss", t('supersample'))
         dpg.set_item_label("export_btn", t('export_gif_mp4'))
         dpg.set_item_label("tools_text", t('tools'))
         dpg.set_item_label("select_btn", t('select'))
@@ -77,22 +103,38 @@ def setup_gui(scene, storage, render):
         dpg.set_item_label("new_bone_id", t('id'))
         dpg.set_item_label("new_bone_parent", t('parent'))
         dpg.set_item_label("add_btn", t('add'))
+        dpg.set_item_label("reparent_btn", t('reparent_selected'))
         dpg.set_item_label("delete_btn", t('delete_selected'))
+        dpg.set_item_label("add_mesh_btn", t('add_mesh'))
         dpg.set_item_label("undo_btn", t('undo'))
         dpg.set_item_label("redo_btn", t('redo'))
         dpg.set_item_label("onion_prev_cb", t('onion_prev'))
         dpg.set_item_label("onion_next_cb", t('onion_next'))
         dpg.set_item_label("onion_alpha_slider", t('onion_alpha'))
         dpg.set_item_label("frame_slider", t('frame'))
+        dpg.set_item_label("thumb_offset", t('timeline'))
         dpg.set_item_label("add_frame_btn", t('add_frame'))
         dpg.set_item_label("play_pause_btn", t('play_pause'))
         dpg.set_item_label("fps_slider", t('fps'))
+        dpg.set_item_label("retime_fps", t('target_fps'))
+        dpg.set_item_label("retime_btn", t('retime'))
+        dpg.set_item_label("export_retimed_cb", t('export_retimed'))
         dpg.set_item_label("bones_text", t('bones'))
+        dpg.set_item_label("bone_filter", t('filter'))
+        dpg.set_item_label("tree_scroll", t('scroll'))
         dpg.set_item_label("properties_text", t('properties'))
         dpg.set_item_label("prop_x", t('x'))
         dpg.set_item_label("prop_y", t('y'))
         dpg.set_item_label("prop_angle", t('angle'))
         dpg.set_item_label("prop_length", t('length'))
+        dpg.set_item_label("constraints_text", t('constraints'))
+        dpg.set_item_label("constraint_type", t('type'))
+        dpg.set_item_label("constraint_target", t('target'))
+        dpg.set_item_label("constraint_min", t('min'))
+        dpg.set_item_label("constraint_max", t('max'))
+        dpg.set_item_label("constraint_offset", t('offset'))
+        dpg.set_item_label("add_constraint_btn", t('add_constraint'))
+        dpg.set_item_label("clear_constraints_btn", t('clear_constraints'))
         update_ui()  # Update status / Обновляем статус
         logger.debug(f'UI reloaded for language {state["language"]} | {file_id}')
         logger.debug(f'end reload UI | {file_id}')
@@ -100,42 +142,147 @@ def setup_gui(scene, storage, render):
     # Initialization of translations / Инициализация переводов
     load_translations(state['language'])
 
+    # Spatial index of the current frame for picking / Пространственный индекс текущего кадра
+    grid = spatial.SegmentGrid()
+    thumbs = thumbnails.ThumbnailCache()
+    # Widgets are written only when their value changes / Виджеты обновляются только при изменении
+    ui = uimodel.UIModel(dpg.set_value, dpg.configure_item)
+    tree = uimodel.BoneTreeView(TREE_ROWS)
+
     def update_positions():
         logger.info(f'update positions | {file_id}')
+        abs_pos = scene.compute_abs_positions(state['current_frame'])
         state['positions'] = {
             k: {"x": v[0], "y": v[1], "angle": v[2], "length": v[3]}
-            for k, v in scene.compute_abs_positions(state['current_frame']).items()
+            for k, v in abs_pos.items()
         }
+        grid.update(abs_pos)
         logger.debug(f'positions updated for frame {state["current_frame"]} | {file_id}')
         logger.debug(f'end update positions | {file_id}')
 
     def update_ui():
         logger.info(f'update UI | {file_id}')
-        dpg.set_value("frame_slider", state['current_frame'])
-        dpg.configure_item("frame_slider", max_value=max(scene.frames.keys()))
-        dpg.set_value("bone_list", list(scene.bones.keys()))
+        if ui.changed('frames', (len(scene.frames), scene.base_revision)):
+            state['last_frame'] = max(scene.frames.keys())
+            ui.configure("frame_slider", max_value=state['last_frame'])
+            ui.configure("thumb_offset", max_value=max(0, state['last_frame'] - THUMB_SLOTS + 1))
+        ui.set("frame_slider", state['current_frame'])
+        follow_thumbnails()
+        update_bone_tree()
         if state['selected_bone'] and state['selected_bone'] in scene.bones:
-            b = scene.bones[state['selected_bone']]
-            overrides = scene.frames.get(state['current_frame'], {}).get(state['selected_bone'], {})
-            dpg.set_value("prop_x", overrides.get('x', b.x))
-            dpg.set_value("prop_y", overrides.get('y', b.y))
-            dpg.set_value("prop_angle", overrides.get('angle', b.angle))
-            dpg.set_value("prop_length", overrides.get('length', b.length))
-        dpg.set_value("status_text",
-                      f"{t('frame')}: {state['current_frame']} | {t('bones')}: {state['selected_bone']} | {t('tool_mode')}: {state['tool_mode']}")
-        dpg.set_value("job_status_text", state['job_status'])
+            x, y, angle, length = scene.local_values(state['current_frame'], state['selected_bone'])
+            ui.set("prop_x", x)
+            ui.set("prop_y", y)
+            ui.set("prop_angle", angle)
+            ui.set("prop_length", length)
+            ui.set("constraint_list", "\n".join(
+                f"{c['type']} {c.get('target', '')}".strip() for c in scene.bones[state['selected_bone']].constraints))
+        ui.set("status_text",
+               f"{t('frame')}: {state['current_frame']} | {t('bones')}: {state['selected_bone']} | {t('tool_mode')}: {state['tool_mode']}")
+        ui.set("job_status_text", state['job_status'])
         logger.debug(f'UI updated, selected bone: {state["selected_bone"]} | {file_id}')
         logger.debug(f'end update UI | {file_id}')
 
+    def update_bone_tree():
+        # Only TREE_ROWS rows exist, they show a window of the flattened tree
+        # Существует только TREE_ROWS строк, они показывают окно развёрнутого дерева
+        if tree.refresh(scene):
+            ui.configure("tree_scroll", max_value=tree.max_offset())
+        ui.set("tree_scroll", tree.offset)
+        for i, item in enumerate(tree.window()):
+            if item is None:
+                ui.configure(f"tree_item_{i}", show=False)
+                continue
+            bid, depth, has_children = item
+            ui.configure(f"tree_item_{i}", show=True)
+            ui.configure(f"tree_toggle_{i}", label=('+' if bid in tree.collapsed else '-') if has_children else ' ')
+            ui.configure(f"tree_row_{i}", label="  " * depth + bid)
+            ui.set(f"tree_row_{i}", bid == state['selected_bone'])
+
+    def tree_row_click(sender, app_data, user_data):
+        ui.forget(sender)
+        item = tree.window()[user_data]
+        if item:
+            select_bone(sender, item[0])
+
+    def tree_toggle_click(sender, app_data, user_data):
+        item = tree.window()[user_data]
+        if item and item[2]:
+            logger.debug(f'toggle tree node {item[0]} | {file_id}')
+            tree.toggle(item[0])
+            update_bone_tree()
+
+    def tree_filter(sender, data):
+        logger.debug(f'bone filter {data} | {file_id}')
+        tree.set_filter(data)
+        update_bone_tree()
+
+    def tree_scroll(sender, data):
+        ui.forget(sender)
+        tree.offset = data
+        update_bone_tree()
+
+    def tree_wheel(sender, app_data):
+        if dpg.is_item_hovered("bone_panel"):
+            tree.offset = max(0, min(tree.offset - int(app_data), tree.max_offset()))
+            update_bone_tree()
+
+    def follow_thumbnails():
+        # Keep the current frame inside the visible strip / Текущий кадр остаётся в видимой полосе
+        cur = state['current_frame']
+        if not state['thumb_offset'] <= cur < state['thumb_offset'] + THUMB_SLOTS:
+            state['thumb_offset'] = max(0, min(cur - THUMB_SLOTS // 2, state['last_frame'] - THUMB_SLOTS + 1))
+        ui.set("thumb_offset", state['thumb_offset'])
+
+    def refresh_thumbnails():
+        # Only the visible window is requested; runs on the same thread as callbacks (see the render loop),
+        # an error must not end the loop / Запрашивается только видимое окно; ошибка не должна завершать цикл
+        first = state['thumb_offset']
+        frames = list(range(first, min(first + THUMB_SLOTS, state['last_frame'] + 1)))
+        try:
+            keys = thumbs.request(scene, frames)
+        except Exception as e:
+            logger.error(f'error requesting thumbnails: {e} | {file_id}')
+            return
+        thumbs.poll()
+        for i in range(THUMB_SLOTS):
+            key = keys[i] if i < len(keys) else None
+            if key == state['thumb_slots'][i]:
+                continue
+            if key is None:
+                dpg.configure_item(f"thumb_btn_{i}", show=False)
+                state['thumb_slots'][i] = None
+                continue
+            pixels = thumbs.get(key)
+            if pixels is None:
+                continue
+            dpg.set_value(f"thumb_tex_{i}", pixels)
+            dpg.configure_item(f"thumb_btn_{i}", show=True)
+            state['thumb_slots'][i] = key
+
+    def thumbnail_click(sender, app_data, user_data):
+        logger.info(f'thumbnail click | {file_id}')
+        change_frame(sender, state['thumb_offset'] + user_data)
+
+    def scroll_thumbnails(sender, data):
+        logger.debug(f'scroll thumbnails to {data} | {file_id}')
+        ui.forget(sender)
+        state['thumb_offset'] = data
+
     def render_scene():
         logger.info(f'render scene | {file_id}')
         dpg.delete_item("drawlist", children_only=True)
+        for name, verts in skinning.deform_scene(scene, [state['current_frame']]).items():
+            color = scene.attachments[name].color
+            for p0, p1, p2 in verts[0][scene.attachments[name].triangles].tolist():
+                dpg.draw_triangle(p0, p1, p2, color=color, fill=color, parent="drawlist")
         for bid, pos in state['positions'].items():
             x, y = pos['x'], pos['y']
             ex = x + np.cos(np.radians(pos['angle'])) * pos['length']
             ey = y + np.sin(np.radians(pos['angle'])) * pos['length']
-            dpg.draw_line((x, y), (ex, ey), color=(0, 0, 0, 255), thickness=4, parent="drawlist")
-            dpg.draw_circle((x, y), 4, color=(0, 0, 0, 255), fill=(0, 0, 0, 255), parent="drawlist")
+            color = (220, 40, 40, 255) if bid in state['selected_bones'] else (0, 0, 0, 255)
+            dpg.draw_line((x, y), (ex, ey), color=color, thickness=4, parent="drawlist")
+            dpg.draw_circle((x, y), 4, color=color, fill=color, parent="drawlist")
         if state['onion_prev'] and state['current_frame'] > 0:
             prev_pos = scene.compute_abs_positions(state['current_frame'] - 1)
             for bid, v in prev_pos.items():
@@ -178,6 +325,7 @@ def setup_gui(scene, storage, render):
 
     def change_frame(sender, data):
         logger.info(f'change frame | {file_id}')
+        ui.forget("frame_slider")
         state['current_frame'] = data
         update_positions()
         update_ui()
@@ -188,12 +336,42 @@ def setup_gui(scene, storage, render):
     def select_bone(sender, data):
         logger.info(f'select bone | {file_id}')
         state['selected_bone'] = data
+        state['selected_bones'] = {data} if data else set()
         update_ui()
+        render_scene()
         logger.debug(f'bone selected {data} | {file_id}')
         logger.debug(f'end select bone | {file_id}')
 
+    def viewport_mouse_down(sender, app_data):
+        if not dpg.is_item_hovered("drawlist"):
+            return
+        state['drag_start'] = tuple(dpg.get_drawing_mouse_pos())
+        logger.debug(f'viewport drag start {state["drag_start"]} | {file_id}')
+
+    def viewport_mouse_release(sender, app_data):
+        logger.info(f'viewport pick | {file_id}')
+        start = state['drag_start']
+        state['drag_start'] = None
+        if start is None:
+            return
+        end = dpg.get_drawing_mouse_pos()
+        if abs(end[0] - start[0]) <= PICK_RADIUS / 2 and abs(end[1] - start[1]) <= PICK_RADIUS / 2:
+            bid = grid.nearest(end[0], end[1], PICK_RADIUS)
+            picked = [bid] if bid else []
+        else:
+            picked = grid.query_box(start[0], start[1], end[0], end[1])
+        state['selected_bones'] = set(picked)
+        state['selected_bone'] = picked[0] if picked else None
+        if picked:
+            tree.reveal(picked[0])
+        update_ui()
+        render_scene()
+        logger.debug(f'picked bones {picked} | {file_id}')
+        logger.debug(f'end viewport pick | {file_id}')
+
     def update_prop(sender, data):
         logger.info(f'update prop | {file_id}')
+        ui.forget(sender)
         if state['selected_bone']:
             key = dpg.get_item_user_data(sender)
             updates = {key: data}
@@ -209,24 +387,89 @@ def setup_gui(scene, storage, render):
         logger.info(f'add bone cb | {file_id}')
         bid = dpg.get_value("new_bone_id")
         parent = dpg.get_value("new_bone_parent")
-        if bid and bid not in scene.bones:
+        if bid and bid not in scene.bones and (not parent or parent in scene.bones):
             scene.push_undo()
-            scene.bones[bid] = scene.Bone(id=bid, parent=parent)
+            scene.add_bone(bid, parent)
+            update_positions()
             update_ui()
             render_scene()
             logger.debug(f'bone added {bid} with parent {parent} | {file_id}')
         logger.debug(f'end add bone cb | {file_id}')
 
+    def reparent_bone_cb():
+        logger.info(f'reparent bone cb | {file_id}')
+        parent = dpg.get_value("new_bone_parent")
+        bid = state['selected_bone']
+        if bid and bid in scene.bones and (not parent or parent in scene.bones):
+            scene.push_undo()
+            # Refused on a parent or constraint cycle / Отказ при цикле родителей или ограничений
+            if scene.reparent_bone(bid, parent):
+                update_positions()
+                update_ui()
+                render_scene()
+                logger.debug(f'bone {bid} reparented to {parent} | {file_id}')
+            else:
+                scene.undo_stack.pop()
+        logger.debug(f'end reparent bone cb | {file_id}')
+
+    def add_constraint_cb():
+        logger.info(f'add constraint cb | {file_id}')
+        bid = state['selected_bone']
+        kind = dpg.get_value("constraint_type")
+        if bid and bid in scene.bones:
+            if kind == 'limit':
+                constraint = {"type": kind, "min": dpg.get_value("constraint_min"),
+                              "max": dpg.get_value("constraint_max")}
+            elif kind == 'look_at':
+                constraint = {"type": kind, "target": dpg.get_value("constraint_target"),
+                              "offset": dpg.get_value("constraint_offset")}
+            else:
+                constraint = {"type": kind, "target": dpg.get_value("constraint_target"),
+                              "angle": dpg.get_value("constraint_offset")}
+            scene.push_undo()
+            if scene.add_constraint(bid, constraint):
+                update_positions()
+                update_ui()
+                render_scene()
+                logger.debug(f'constraint {constraint} added to {bid} | {file_id}')
+            else:
+                scene.undo_stack.pop()
+        logger.debug(f'end add constraint cb | {file_id}')
+
+    def clear_constraints_cb():
+        logger.info(f'clear constraints cb | {file_id}')
+        bid = state['selected_bone']
+        if bid and bid in scene.bones and scene.bones[bid].constraints:
+            scene.push_undo()
+            scene.clear_constraints(bid)
+            update_positions()
+            update_ui()
+            render_scene()
+            logger.debug(f'constraints of {bid} cleared | {file_id}')
+        logger.debug(f'end clear constraints cb | {file_id}')
+
+    def add_mesh_cb():
+        logger.info(f'add mesh cb | {file_id}')
+        bid = state['selected_bone']
+        if bid and bid in scene.bones:
+            scene.push_undo()
+            att = skinning.make_bone_mesh(scene, f"{bid}_mesh", bid, state['current_frame'])
+            scene.attachments[att.name] = att
+            render_scene()
+            logger.debug(f'mesh {att.name} attached to {bid} | {file_id}')
+        logger.debug(f'end add mesh cb | {file_id}')
+
     def delete_bone_cb():
         logger.info(f'delete bone cb | {file_id}')
         if state['selected_bone']:
             scene.push_undo()
-            scene.delete_bone(state['selected_bone'])
+            removed = scene.delete_bone(state['selected_bone'])
             state['selected_bone'] = None
+            state['selected_bones'] = set()
             update_positions()
             update_ui()
             render_scene()
-            logger.debug(f'bone deleted {state["selected_bone"]} | {file_id}')
+            logger.debug(f'bones deleted {removed} | {file_id}')
         logger.debug(f'end delete bone cb | {file_id}')
 
     def undo_cb():
@@ -279,44 +522,102 @@ def setup_gui(scene, storage, render):
             logger.debug(f'loaded example XML {name} | {file_id}')
         logger.debug(f'end load example xml cb | {file_id}')
 
+    def reduce_tolerance():
+        if not dpg.get_value("reduce_on_save_cb"):
+            return None
+        return dpg.get_value("reduce_pos_tol"), dpg.get_value("reduce_angle_tol")
+
+    def reduce_keys_cb():
+        logger.info(f'reduce keys cb | {file_id}')
+        scene.push_undo()
+        stats = scene.reduce_keys(dpg.get_value("reduce_pos_tol"), dpg.get_value("reduce_angle_tol"))
+        state['job_status'] = (f"{t('keys')}: {stats['keys_before']} -> {stats['keys_after']} "
+                               f"(x{stats['ratio']:.2f}), {t('max_error')}: {stats['max_error_pos']:.3f} / "
+                               f"{stats['max_error_angle']:.3f}")
+        update_positions()
+        update_ui()
+        render_scene()
+        logger.debug(f'keys reduced {stats} | {file_id}')
+        logger.debug(f'end reduce keys cb | {file_id}')
+
+    def set_io_progress(value):
+        # Called from the storage worker / Вызывается из потока хранения
+        state['io_progress'] = value
+
+    def start_io(future, on_done):
+        logger.info(f'start io task | {file_id}')
+        if not state['io_tasks']:
+            state['io_max_frame_ms'] = 0.0
+        state['io_progress'] = 0.0
+        state['io_tasks'].append((future, on_done))
+        dpg.configure_item("io_progress", show=True)
+
+    def poll_io():
+        if not state['io_tasks']:
+            return
+        dpg.set_value("io_progress", state['io_progress'])
+        for task in [task for task in state['io_tasks'] if task[0].done()]:
+            state['io_tasks'].remove(task)
+            future, on_done = task
+            on_done(future.result())
+        if not state['io_tasks']:
+            dpg.configure_item("io_progress", show=False)
+
+    def io_saved(path, combo, extension):
+        dpg.configure_item(combo, items=storage.list_saved(extension))
+        state['job_status'] = (f"{t('saved') if path else t('save_failed')}: {path} | "
+                               f"{t('max_frame_ms')}: {state['io_max_frame_ms']:.1f}")
+        update_ui()
+        logger.debug(f'saved to {path}, max frame {state["io_max_frame_ms"]:.1f} ms | {file_id}')
+
+    def io_loaded(loaded, name):
+        if loaded is None:
+            state['job_status'] = f"{t('load_failed')}: {name}"
+            update_ui()
+            return
+        storage.apply_loaded(scene, loaded)
+        state['current_frame'] = 0
+        state['selected_bone'] = None
+        state['selected_bones'] = set()
+        state['job_status'] = ""
+        update_positions()
+        update_ui()
+        render_scene()
+        logger.debug(f'loaded saved {name} | {file_id}')
+
     def save_scene_cb():
         logger.info(f'save scene cb | {file_id}')
         name = dpg.get_value("save_name")
         if name:
-            path = storage.save_scene(name, scene)
-            dpg.configure_item("load_combo", items=storage.list_saved('.json'))
-            logger.debug(f'saved JSON to {path} | {file_id}')
+            future = storage.save_scene_async(name, scene, tolerance=reduce_tolerance(), progress=set_io_progress)
+            start_io(future, lambda path: io_saved(path, "load_combo", '.json'))
+            logger.debug(f'saving JSON {name} | {file_id}')
         logger.debug(f'end save scene cb | {file_id}')
 
     def save_scene_xml_cb():
         logger.info(f'save scene xml cb | {file_id}')
         name = dpg.get_value("save_name_xml")
         if name:
-            path = storage.save_scene(name, scene, is_xml=True)
-            dpg.configure_item("load_xml_combo", items=storage.list_saved('.xml'))
-            logger.debug(f'saved XML to {path} | {file_id}')
+            future = storage.save_scene_async(name, scene, is_xml=True, tolerance=reduce_tolerance(),
+                                              progress=set_io_progress)
+            start_io(future, lambda path: io_saved(path, "load_xml_combo", '.xml'))
+            logger.debug(f'saving XML {name} | {file_id}')
         logger.debug(f'end save scene xml cb | {file_id}')
 
     def load_scene_cb():
         logger.info(f'load scene cb | {file_id}')
         name = dpg.get_value("load_combo")
-        if name and storage.load_saved(name, scene):
-            state['current_frame'] = 0
-            update_positions()
-            update_ui()
-            render_scene()
-            logger.debug(f'loaded saved JSON {name} | {file_id}')
+        if name:
+            start_io(storage.load_saved_async(name), lambda loaded: io_loaded(loaded, name))
+            logger.debug(f'loading saved JSON {name} | {file_id}')
         logger.debug(f'end load scene cb | {file_id}')
 
     def load_scene_xml_cb():
         logger.info(f'load scene xml cb | {file_id}')
         name = dpg.get_value("load_xml_combo")
-        if name and storage.load_saved(name, scene, is_xml=True):
-            state['current_frame'] = 0
-            update_positions()
-            update_ui()
-            render_scene()
-            logger.debug(f'loaded saved XML {name} | {file_id}')
+        if name:
+            start_io(storage.load_saved_async(name, is_xml=True), lambda loaded: io_loaded(loaded, name))
+            logger.debug(f'loading saved XML {name} | {file_id}')
         logger.debug(f'end load scene xml cb | {file_id}')
 
     def start_render_cb():
@@ -329,10 +630,36 @@ def setup_gui(scene, storage, render):
 
         state['job_status'] = "starting"
         update_ui()
-        asyncio.create_task(render.export_animation(scene, state['fps'], update_status))
+        size = (dpg.get_value("export_width"), dpg.get_value("export_height"))
+        supersample = dpg.get_value("export_ss")
+        if dpg.get_value("export_retimed_cb"):
+            # Resampled on the fly, the scene keeps its frames / Пересэмплируется на лету, кадры сцены не меняются
+            target = dpg.get_value("retime_fps")
+            times = retime.resample(retime.identity(max(scene.frames.keys()) + 1), state['fps'], target)
+            asyncio.create_task(render.export_animation(scene, target, update_status, times=times, size=size,
+                                                        supersample=supersample))
+        else:
+            asyncio.create_task(render.export_animation(scene, state['fps'], update_status, size=size,
+                                                        supersample=supersample))
         logger.debug(f'export started | {file_id}')
         logger.debug(f'end start render cb | {file_id}')
 
+    def retime_cb():
+        logger.info(f'retime cb | {file_id}')
+        target = dpg.get_value("retime_fps")
+        if target > 0 and target != state['fps']:
+            scene.push_undo()
+            times = retime.resample(retime.identity(max(scene.frames.keys()) + 1), state['fps'], target)
+            count = retime.apply(scene, times)
+            state['fps'] = target
+            dpg.set_value("fps_slider", target)
+            state['current_frame'] = min(state['current_frame'], count - 1)
+            update_positions()
+            update_ui()
+            render_scene()
+            logger.debug(f'retimed to {target} fps, {count} frames | {file_id}')
+        logger.debug(f'end retime cb | {file_id}')
+
     def set_tool(sender, data):
         logger.info(f'set tool | {file_id}')
         state['tool_mode'] = data
@@ -371,6 +698,12 @@ def setup_gui(scene, storage, render):
     dpg.create_context()
     dpg.create_viewport(title=t('title'), width=1200, height=800)
 
+    with dpg.texture_registry():
+        blank = [1.0] * (thumbnails.THUMB_SIZE[0] * thumbnails.THUMB_SIZE[1] * 4)
+        for i in range(THUMB_SLOTS):
+            dpg.add_dynamic_texture(width=thumbnails.THUMB_SIZE[0], height=thumbnails.THUMB_SIZE[1],
+                                    default_value=blank, tag=f"thumb_tex_{i}")
+
     # Font setup for Russian support / Настройка шрифта для поддержки русского
     try:
         sys_platform = platform.system()
@@ -425,8 +758,21 @@ def setup_gui(scene, storage, render):
                 dpg.add_combo(label=t('load_xml'), tag="load_xml_combo", items=storage.list_saved('.xml'),
                               callback=load_scene_xml_cb)
                 dpg.add_separator()
+                dpg.add_checkbox(label=t('reduce_on_save'), tag="reduce_on_save_cb", default_value=False)
+                dpg.add_input_float(label=t('reduce_pos_tol'), tag="reduce_pos_tol", default_value=0.5, min_value=0.0,
+                                    min_clamped=True)
+                dpg.add_input_float(label=t('reduce_angle_tol'), tag="reduce_angle_tol", default_value=0.5,
+                                    min_value=0.0, min_clamped=True)
+                dpg.add_button(label=t('reduce_keys'), tag="reduce_keys_btn", callback=reduce_keys_cb)
+                dpg.add_separator()
+                dpg.add_input_int(label=t('export_width'), tag="export_width", default_value=500, min_value=16,
+                                  max_value=16384, min_clamped=True, max_clamped=True)
+                dpg.add_input_int(label=t('export_height'), tag="export_height", default_value=500, min_value=16,
+                                  max_value=16384, min_clamped=True, max_clamped=True)
+                dpg.add_slider_int(label=t('supersample'), tag="export_ss", default_value=2, min_value=1, max_value=4)
                 dpg.add_button(label=t('export_gif_mp4'), tag="export_btn", callback=start_render_cb)
                 dpg.add_text(tag="job_status_text", default_value="")
+                dpg.add_progress_bar(tag="io_progress", default_value=0.0, show=False)
 
             # Language selection / Выбор языка
             with dpg.menu(label=t('language')):
@@ -445,7 +791,9 @@ def setup_gui(scene, storage, render):
                 dpg.add_input_text(tag="new_bone_id", label=t('id'))
                 dpg.add_input_text(tag="new_bone_parent", label=t('parent'))
                 dpg.add_button(label=t('add'), tag="add_btn", callback=add_bone_cb)
+                dpg.add_button(label=t('reparent_selected'), tag="reparent_btn", callback=reparent_bone_cb)
                 dpg.add_button(label=t('delete_selected'), tag="delete_btn", callback=delete_bone_cb)
+                dpg.add_button(label=t('add_mesh'), tag="add_mesh_btn", callback=add_mesh_cb)
                 dpg.add_separator()
                 dpg.add_button(label=t('undo'), tag="undo_btn", callback=undo_cb)
                 dpg.add_button(label=t('redo'), tag="redo_btn", callback=redo_cb)
@@ -463,20 +811,50 @@ def setup_gui(scene, storage, render):
                     pass
                 dpg.add_slider_int(tag="frame_slider", label=t('frame'), default_value=0, min_value=0, max_value=0,
                                    callback=change_frame)
+                with dpg.group(horizontal=True):
+                    for i in range(THUMB_SLOTS):
+                        dpg.add_image_button(f"thumb_tex_{i}", tag=f"thumb_btn_{i}", callback=thumbnail_click,
+                                             user_data=i, show=False)
+                dpg.add_slider_int(tag="thumb_offset", label=t('timeline'), default_value=0, min_value=0,
+                                   max_value=0, callback=scroll_thumbnails)
                 dpg.add_button(label=t('add_frame'), tag="add_frame_btn", callback=add_frame_cb)
                 dpg.add_button(label=t('play_pause'), tag="play_pause_btn", callback=toggle_play)
                 dpg.add_slider_int(label=t('fps'), tag="fps_slider", default_value=12, min_value=1, max_value=60,
                                    callback=set_fps)
+                dpg.add_input_int(label=t('target_fps'), tag="retime_fps", default_value=24, min_value=1,
+                                  max_value=240, min_clamped=True, max_clamped=True)
+                dpg.add_button(label=t('retime'), tag="retime_btn", callback=retime_cb)
+                dpg.add_checkbox(label=t('export_retimed'), tag="export_retimed_cb", default_value=False)
 
             with dpg.child_window(width=200):
                 dpg.add_text(t('bones'), tag="bones_text")
-                dpg.add_listbox(tag="bone_list", items=[], callback=select_bone, num_items=10)
+                dpg.add_input_text(tag="bone_filter", label=t('filter'), callback=tree_filter)
+                with dpg.child_window(tag="bone_panel", height=TREE_ROWS * 23 + 8, no_scrollbar=True):
+                    for i in range(TREE_ROWS):
+                        with dpg.group(tag=f"tree_item_{i}", horizontal=True, show=False):
+                            dpg.add_button(tag=f"tree_toggle_{i}", label=" ", width=18, callback=tree_toggle_click,
+                                           user_data=i)
+                            dpg.add_selectable(tag=f"tree_row_{i}", label="", callback=tree_row_click, user_data=i)
+                dpg.add_slider_int(tag="tree_scroll", label=t('scroll'), default_value=0, min_value=0, max_value=0,
+                                   callback=tree_scroll)
                 dpg.add_separator()
                 dpg.add_text(t('properties'), tag="properties_text")
                 dpg.add_input_float(tag="prop_x", label=t('x'), callback=update_prop, user_data="x")
                 dpg.add_input_float(tag="prop_y", label=t('y'), callback=update_prop, user_data="y")
                 dpg.add_input_float(tag="prop_angle", label=t('angle'), callback=update_prop, user_data="angle")
                 dpg.add_input_float(tag="prop_length", label=t('length'), callback=update_prop, user_data="length")
+                dpg.add_separator()
+                dpg.add_text(t('constraints'), tag="constraints_text")
+                dpg.add_text("", tag="constraint_list")
+                dpg.add_combo(list(core.CONSTRAINT_TYPES), tag="constraint_type", label=t('type'),
+                              default_value=core.CONSTRAINT_TYPES[0])
+                dpg.add_input_text(tag="constraint_target", label=t('target'))
+                dpg.add_input_float(tag="constraint_min", label=t('min'), default_value=-45.0)
+                dpg.add_input_float(tag="constraint_max", label=t('max'), default_value=45.0)
+                dpg.add_input_float(tag="constraint_offset", label=t('offset'), default_value=0.0)
+                dpg.add_button(label=t('add_constraint'), tag="add_constraint_btn", callback=add_constraint_cb)
+                dpg.add_button(label=t('clear_constraints'), tag="clear_constraints_btn",
+                               callback=clear_constraints_cb)
 
         dpg.add_text(tag="status_text", default_value=t('status'))
 
@@ -498,9 +876,24 @@ def setup_gui(scene, storage, render):
     with dpg.handler_registry():
         dpg.add_key_press_handler(key=dpg.mvKey_Z, callback=z_pressed)
         dpg.add_key_press_handler(key=dpg.mvKey_Y, callback=y_pressed)
+        dpg.add_mouse_click_handler(button=dpg.mvMouseButton_Left, callback=viewport_mouse_down)
+        dpg.add_mouse_release_handler(button=dpg.mvMouseButton_Left, callback=viewport_mouse_release)
+        dpg.add_mouse_wheel_handler(callback=tree_wheel)
 
+    # Callbacks are queued and run by the render loop, so every Scene access happens on one thread
+    # Колбэки ставятся в очередь и выполняются циклом отрисовки: вся работа со Scene в одном потоке
+    dpg.configure_app(manual_callback_management=True)
     dpg.setup_dearpygui()
     dpg.show_viewport()
-    dpg.start_dearpygui()
+    # Manual render loop: callbacks, finished storage jobs and thumbnails run here between frames
+    # Ручной цикл отрисовки: колбэки, завершённые задачи хранения и миниатюры выполняются здесь
+    while dpg.is_dearpygui_running():
+        started = perf_counter()
+        dpg.run_callbacks(dpg.get_callback_queue())
+        poll_io()
+        refresh_thumbnails()
+        dpg.render_dearpygui_frame()
+        if state['io_tasks']:
+            state['io_max_frame_ms'] = max(state['io_max_frame_ms'], (perf_counter() - started) * 1000)
     dpg.destroy_context()
     logger.info(f'GUI closed | {file_id}')
\ No newline at end of file
@@ -0,0 +1,143 @@
+# /keyreduce.py
+# Keyframe reduction / Сокращение ключевых кадров
+
+from bisect import bisect_right
+from typing import Dict, List, Tuple
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+logger.debug('keyreduce.py run')
+file_id = 'keyreduce'
+
+CHANNELS = ('x', 'y', 'angle', 'length')
+
+
+def curve_value(keys, frame_idx):
+    """Linear interpolation of [[frame, value], ...] keys, None outside the keyed range."""
+    if not keys or frame_idx < keys[0][0] or frame_idx > keys[-1][0]:
+        return None
+    i = bisect_right(keys, [frame_idx, float('inf')]) - 1
+    f0, v0 = keys[i]
+    if f0 == frame_idx or i + 1 >= len(keys):
+        return v0
+    f1, v1 = keys[i + 1]
+    return v0 + (v1 - v0) * (frame_idx - f0) / (f1 - f0)
+
+
+def fit_keys(t: np.ndarray, v: np.ndarray, tol: float) -> Tuple[np.ndarray, float]:
+    """Douglas-Peucker fit of samples v(t) by a polyline within tol.
+
+    Returns the indices of the kept samples and the max reconstruction error.
+    """
+    n = len(t)
+    if n <= 2:
+        return np.arange(n), 0.0
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        seg_t = t[i:j + 1]
+        line = v[i] + (v[j] - v[i]) * (seg_t - t[i]) / (t[j] - t[i])
+        err = np.abs(v[i:j + 1] - line)
+        k = int(np.argmax(err))
+        if err[k] > tol:
+            keep[i + k] = True
+            stack.append((i, i + k))
+            stack.append((i + k, j))
+    idx = np.flatnonzero(keep)
+    max_err = float(np.max(np.abs(np.interp(t, t[idx], v[idx]) - v)))
+    return idx, max_err
+
+
+def sample_channels(data, frame_ids: List[int]):
+    """Dense (F, B * 4) matrix of local channel values from scene dict data.
+
+    Also returns the column labels and a mask of columns that carry any keys.
+    """
+    bones = list(data["bones"].keys())
+    cols = [(b, c) for b in bones for c in CHANNELS]
+    col = {bc: i for i, bc in enumerate(cols)}
+    t = np.asarray(frame_ids, dtype=float)
+    values = np.tile([float(data["bones"][b][c]) for b, c in cols], (len(frame_ids), 1))
+    keyed = np.zeros(len(cols), dtype=bool)
+    for bid, channels in data.get("curves", {}).items():
+        for c, keys in channels.items():
+            if (bid, c) not in col or not keys:
+                continue
+            k = np.asarray(keys, dtype=float)
+            inside = (t >= k[0, 0]) & (t <= k[-1, 0])
+            j = col[(bid, c)]
+            values[inside, j] = np.interp(t[inside], k[:, 0], k[:, 1])
+            keyed[j] = True
+    # Only the requested frames are visited / Обходятся только запрошенные кадры
+    frames = data["frames"]
+    for i, f in enumerate(frame_ids):
+        frame = frames.get(f)
+        if not frame:
+            continue
+        for bid, overrides in frame.items():
+            for c, val in overrides.items():
+                j = col.get((bid, c))
+                if j is not None:
+                    values[i, j] = val
+                    keyed[j] = True
+    return values, cols, keyed
+
+
+def reduce_keys(data, pos_tol=0.5, angle_tol=0.5) -> Dict[str, float]:
+    """Replace per-frame overrides in scene dict data by sparse curve keys, in place.
+
+    A channel is converted only when the fitted curve needs fewer keys than it had.
+    Frame poses may be shared, so they are replaced by stripped copies, never edited.
+    """
+    logger.info(f'reduce keys, pos_tol={pos_tol}, angle_tol={angle_tol} | {file_id}')
+    frames = data["frames"]
+    curves = data.setdefault("curves", {})
+    frame_ids = sorted(frames.keys())
+    stats = {"keys_before": 0, "keys_after": 0, "ratio": 1.0, "max_error_pos": 0.0, "max_error_angle": 0.0}
+    if not frame_ids or not data["bones"]:
+        return stats
+    counts: Dict[Tuple[str, str], int] = {}
+    for frame in frames.values():
+        for bid, overrides in frame.items():
+            for c in overrides:
+                counts[(bid, c)] = counts.get((bid, c), 0) + 1
+    for bid, channels in curves.items():
+        for c, keys in channels.items():
+            counts[(bid, c)] = counts.get((bid, c), 0) + len(keys)
+    values, cols, keyed = sample_channels(data, frame_ids)
+    t = np.asarray(frame_ids, dtype=float)
+    for j in np.flatnonzero(keyed):
+        bid, c = cols[j]
+        before = counts.get((bid, c), 0)
+        tol = angle_tol if c == 'angle' else pos_tol
+        idx, err = fit_keys(t, values[:, j], tol)
+        if len(idx) >= before:
+            stats["keys_before"] += before
+            stats["keys_after"] += before
+            continue
+        stats["keys_before"] += before
+        stats["keys_after"] += len(idx)
+        err_key = "max_error_angle" if c == 'angle' else "max_error_pos"
+        stats[err_key] = max(stats[err_key], err)
+        stripped = {}
+        for f, frame in frames.items():
+            if c not in frame.get(bid, ()):
+                continue
+            if id(frame) not in stripped:
+                new = {k: v for k, v in frame.items() if k != bid}
+                rest = {k: v for k, v in frame[bid].items() if k != c}
+                if rest:
+                    new[bid] = rest
+                stripped[id(frame)] = new
+            frames[f] = stripped[id(frame)]
+        curves.setdefault(bid, {})[c] = [[frame_ids[i], float(values[i, j])] for i in idx]
+    if stats["keys_after"]:
+        stats["ratio"] = stats["keys_before"] / stats["keys_after"]
+    logger.info(f'keys {stats["keys_before"]} -> {stats["keys_after"]}, ratio {stats["ratio"]:.2f} | {file_id}')
+    return stats
@@ -6,10 +6,13 @@ import os
 import uuid
 from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from PIL import Image, ImageDraw
+from PIL import GifImagePlugin, Image, ImageDraw
 import imageio
 import logging
 
+import retime
+import skinning
+
 logger = logging.getLogger(__name__)
 
 logger.debug('render.py run')
@@ -23,64 +26,128 @@ try:
 except Exception as e:
     logger.error(f'error creating OUT_DIR: {e} | {file_id}')
 
-executor = ThreadPoolExecutor(max_workers=4)
+# One frame per core is in flight; each keeps one output frame and one supersampled tile
+# По кадру на ядро; каждый держит один выходной кадр и один тайл с суперсэмплингом
+executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
 logger.info(f'ThreadPoolExecutor created | {file_id}')
 
-def draw_frame(positions, size=(500, 500)):
+SCENE_SIZE = (500, 500)  # Scene area exported by default, same as the editor drawlist / Область сцены
+TILE_SIZE = 512
+
+def write_gif(path, frame_paths, fps):
+    # imageio/Pillow GIF writers keep every frame until close; here each frame is quantized
+    # and written right away, so only one is in memory
+    # Писатели GIF imageio/Pillow держат все кадры до закрытия; здесь кадр пишется сразу
+    with open(path, 'wb') as fp:
+        for i, p in enumerate(frame_paths):
+            with Image.open(p) as img:
+                frame = img.convert('RGB').quantize(256)
+            if i == 0:
+                header, _ = GifImagePlugin.getheader(frame, info={"loop": 0})
+                fp.write(b"".join(header))
+            for chunk in GifImagePlugin.getdata(frame, duration=1000 / fps, include_color_table=True):
+                fp.write(chunk)
+        fp.write(b";")
+    logger.debug(f'GIF of {len(frame_paths)} frames written | {file_id}')
+
+def make_view(size, scene_size=SCENE_SIZE):
+    # Scene -> pixel transform (scale, offset x, offset y), scene area fitted and centered
+    # Преобразование сцена -> пиксели, область сцены вписана по центру
+    scale = min(size[0] / scene_size[0], size[1] / scene_size[1])
+    return scale, (size[0] - scene_size[0] * scale) / 2, (size[1] - scene_size[1] * scale) / 2
+
+# positions: solved (B, 4) array of x, y, angle, length / решённый массив (B, 4)
+def draw_frame(positions, size=SCENE_SIZE, meshes=(), view=None, supersample=1, tile=TILE_SIZE):
     try:
         logger.info(f'draw frame | {file_id}')
-        img = Image.new('RGB', size, (255, 255, 255))
-        draw = ImageDraw.Draw(img)
-        for bid, pos in positions.items():
-            x, y = pos['x'], pos['y']
-            angle = pos['angle']
-            length = pos['length']
-            rad = np.radians(angle)
-            ex = x + np.cos(rad) * length
-            ey = y + np.sin(rad) * length
-            draw.line((int(x), int(y), int(ex), int(ey)), fill=(0, 0, 0), width=4)
-            draw.ellipse((int(x - 4), int(y - 4), int(x + 4), int(y + 4)), fill=(0, 0, 0))
+        scale, ox, oy = view or make_view(size)
+        ss = max(1, int(supersample))
+        pos = np.asarray(positions, dtype=float).reshape(-1, 4)
+        rad = np.radians(pos[:, 2])
+        segs = np.stack([pos[:, 0], pos[:, 1], pos[:, 0] + np.cos(rad) * pos[:, 3],
+                         pos[:, 1] + np.sin(rad) * pos[:, 3]], axis=1) * scale + [ox, oy, ox, oy]
+        tris = [(verts[t] * scale + [ox, oy], tuple(color[:3])) for verts, t, color in meshes]
+        half = 2 * scale  # Half line width in pixels / Половина толщины линии в пикселях
+        pad = 4 * scale  # Joint radius, also the culling margin / Радиус сустава, он же запас отсечения
+        out = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        # One tile at a time, only the geometry touching it / По одному тайлу, только попадающая геометрия
+        for ty in range(0, size[1], tile):
+            for tx in range(0, size[0], tile):
+                tw, th = min(tile, size[0] - tx), min(tile, size[1] - ty)
+                img = Image.new('RGB', (tw * ss, th * ss), (255, 255, 255))
+                draw = ImageDraw.Draw(img)
+                shift = np.array([tx, ty])
+                # Skinned meshes go under the bones / Меши рисуются под костями
+                for tri, fill in tris:
+                    lo, hi = tri.min(axis=1), tri.max(axis=1)
+                    hit = (hi[:, 0] >= tx) & (lo[:, 0] <= tx + tw) & (hi[:, 1] >= ty) & (lo[:, 1] <= ty + th)
+                    for t in ((tri[hit] - shift) * ss).tolist():
+                        draw.polygon([tuple(p) for p in t], fill=fill)
+                lo = np.minimum(segs[:, :2], segs[:, 2:]) - pad
+                hi = np.maximum(segs[:, :2], segs[:, 2:]) + pad
+                hit = (hi[:, 0] >= tx) & (lo[:, 0] <= tx + tw) & (hi[:, 1] >= ty) & (lo[:, 1] <= ty + th)
+                r = pad * ss
+                width = max(1, round(2 * half * ss))
+                for x, y, ex, ey in ((segs[hit] - np.tile(shift, 2)) * ss).tolist():
+                    draw.line((x, y, ex, ey), fill=(0, 0, 0), width=width)
+                    draw.ellipse((x - r, y - r, x + r, y + r), fill=(0, 0, 0))
+                if ss > 1:
+                    img = img.reduce(ss)
+                out[ty:ty + th, tx:tx + tw] = np.asarray(img)
         logger.debug(f'draw frame completed | {file_id}')
-        return np.array(img)
+        return out
     except Exception as e:
         logger.error(f'error in draw_frame: {e} | {file_id}')
         return None
 
-async def export_animation(scene, fps, update_status_callback):
+# times: optional retime map (see retime.py), frames are evaluated from it without being stored
+# times: необязательная карта времени (см. retime.py), кадры вычисляются из неё без сохранения
+async def export_animation(scene, fps, update_status_callback, times=None, size=SCENE_SIZE, supersample=1):
     try:
         logger.info(f'export animation | {file_id}')
         update_status_callback("running")
-        frames = []
-        for i in sorted(scene.frames.keys()):
-            pos = scene.compute_abs_positions(i)
-            frames.append(
-                {"positions": {k: {"x": v[0], "y": v[1], "angle": v[2], "length": v[3]} for k, v in pos.items()}})
+        # All frames are solved in one batch / Все кадры решаются одним пакетом
+        order = scene.hierarchy.order()
+        if times is None:
+            solved = scene.solve_frames(sorted(scene.frames.keys()))
+        else:
+            solved = retime.solve(scene, times)
+        # Attachments and their bone columns are captured here, workers skin one frame each
+        # Вложения и их столбцы костей берутся здесь, воркеры считают скининг по одному кадру
+        col = {b: i for i, b in enumerate(order)}
+        skins = [(a, [col[b] for b in a.bones]) for a in scene.attachments.values()]
         job_id = str(uuid.uuid4())
         out_dir = os.path.join(OUT_DIR, job_id)
         os.makedirs(out_dir, exist_ok=True)
         logger.debug(f'export directory {out_dir} created | {file_id}')
 
-        def render_single(i, f):
+        view = make_view(size)
+
+        def render_single(i):
+            # Frames go to disk right away, only paths are kept / Кадры сразу пишутся на диск
             logger.info(f'rendering frame {i} | {file_id}')
-            img = draw_frame(f['positions'])
+            meshes = [(skinning.deform(a, solved[i:i + 1, idx, :3])[0], a.triangles, a.color) for a, idx in skins]
+            img = draw_frame(solved[i], size=size, meshes=meshes, view=view, supersample=supersample)
             p = os.path.join(out_dir, f"frame_{i:04d}.png")
             imageio.imwrite(p, img)
-            return img, p
+            return p
 
         loop = asyncio.get_running_loop()
-        tasks = [loop.run_in_executor(executor, render_single, i, f) for i, f in enumerate(frames)]
-        results = await asyncio.gather(*tasks)
-        imgs, saved_paths = zip(*results)
+        tasks = [loop.run_in_executor(executor, render_single, i) for i in range(len(solved))]
+        saved_paths = await asyncio.gather(*tasks)
+
+        def encode(path):
+            writer = imageio.get_writer(path, fps=fps)
+            for p in saved_paths:
+                writer.append_data(imageio.imread(p))
+            writer.close()
 
         gif_path = os.path.join(out_dir, f"{job_id}.gif")
-        imageio.mimsave(gif_path, imgs, fps=fps)
+        await loop.run_in_executor(executor, write_gif, gif_path, saved_paths, fps)
         logger.debug(f'GIF saved to {gif_path} | {file_id}')
 
         mp4_path = os.path.join(out_dir, f"{job_id}.mp4")
-        writer = imageio.get_writer(mp4_path, fps=fps)
-        for im in imgs:
-            writer.append_data(im)
-        writer.close()
+        await loop.run_in_executor(executor, encode, mp4_path)
         logger.debug(f'MP4 saved to {mp4_path} | {file_id}')
 
         update_status_callback(f"Done: GIF {gif_path}, MP4 {mp4_path}")
@@ -0,0 +1,102 @@
+# /retime.py
+# Time resampling and retiming / Пересэмплирование и ретайминг времени
+
+from typing import Callable, Dict
+import numpy as np
+import logging
+
+from keyreduce import CHANNELS
+
+logger = logging.getLogger(__name__)
+
+logger.debug('retime.py run')
+file_id = 'retime'
+
+# A time map is a float array: for every output frame, the source frame time it shows
+# Карта времени - массив float: для каждого выходного кадра время исходного кадра
+
+EASINGS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "linear": lambda u: u,
+    "ease_in": lambda u: u * u,
+    "ease_out": lambda u: 1 - (1 - u) ** 2,
+    "ease_in_out": lambda u: u * u * (3 - 2 * u),
+}
+
+
+def identity(n_frames) -> np.ndarray:
+    return np.arange(n_frames, dtype=float)
+
+
+def resample(times: np.ndarray, src_fps, dst_fps) -> np.ndarray:
+    """Same duration at dst_fps instead of src_fps."""
+    logger.info(f'resample {len(times)} frames {src_fps} -> {dst_fps} fps | {file_id}')
+    if len(times) < 2:
+        return times.copy()
+    n = int(round((len(times) - 1) * dst_fps / src_fps)) + 1
+    pos = np.linspace(0.0, len(times) - 1, n)
+    return np.interp(pos, np.arange(len(times)), times)
+
+
+def time_warp(times: np.ndarray, start, end, new_length, easing="linear") -> np.ndarray:
+    """Replace output frames start..end (inclusive) by new_length frames eased across the same span."""
+    logger.info(f'time warp {start}..{end} to {new_length} frames, {easing} | {file_id}')
+    u = np.linspace(0.0, 1.0, max(int(new_length), 1))
+    pos = start + EASINGS[easing](u) * (end - start)
+    section = np.interp(pos, np.arange(len(times)), times)
+    return np.concatenate([times[:start], section, times[end + 1:]])
+
+
+def loop_range(times: np.ndarray, start, end, count=2) -> np.ndarray:
+    """Play output frames start..end (inclusive) count times."""
+    logger.info(f'loop {start}..{end} x{count} | {file_id}')
+    section = times[start:end + 1]
+    return np.concatenate([times[:start]] + [section] * count + [times[end + 1:]])
+
+
+def pingpong_range(times: np.ndarray, start, end, count=1) -> np.ndarray:
+    """Play start..end forward then back, count times, without doubling the turn frames."""
+    logger.info(f'ping-pong {start}..{end} x{count} | {file_id}')
+    section = times[start:end + 1]
+    parts = [times[:start]]
+    for n in range(count):
+        parts.append(section[1:] if n else section)
+        parts.append(section[-2::-1])
+    return np.concatenate(parts + [times[end + 1:]])
+
+
+def evaluate(values: np.ndarray, times: np.ndarray) -> np.ndarray:
+    """Sample (F, ...) per-frame values at fractional times in one pass, linear in between."""
+    t = np.clip(times, 0, len(values) - 1)
+    i0 = np.floor(t).astype(int)
+    i1 = np.minimum(i0 + 1, len(values) - 1)
+    w = (t - i0).reshape((-1,) + (1,) * (values.ndim - 1))
+    return values[i0] * (1 - w) + values[i1] * w
+
+
+def source_locals(scene) -> np.ndarray:
+    """Dense (F, B, 4) locals for frames 0..last, bones in hierarchy order."""
+    return scene.sample_locals(range(max(scene.frames.keys()) + 1))
+
+
+def solve(scene, times: np.ndarray) -> np.ndarray:
+    """Solved (T, B, 4) positions for a time map, without creating frames."""
+    return scene.solve_batch(evaluate(source_locals(scene), times))
+
+
+def apply(scene, times: np.ndarray, eps=1e-6) -> int:
+    """Replace scene frames by the retimed animation, returns the new frame count."""
+    logger.info(f'apply time map of {len(times)} frames | {file_id}')
+    order = scene.hierarchy.order()
+    local = evaluate(source_locals(scene), times)
+    rest = np.array([[getattr(scene.bones[b], c) for c in CHANNELS] for b in order]).reshape(-1, len(CHANNELS))
+    differs = np.abs(local - rest) > eps
+    frames = {}
+    for f in range(len(times)):
+        frame = {}
+        for i, c in zip(*np.nonzero(differs[f])):
+            frame.setdefault(order[i], {})[CHANNELS[c]] = float(local[f, i, c])
+        frames[f] = frame
+    scene.set_frames(frames or {0: {}})
+    scene.curves = {}
+    scene.clear_cache()
+    return len(scene.frames)
@@ -0,0 +1,218 @@
+# /service.py
+# Headless pose evaluation service / Сервис вычисления поз без GUI
+#
+# Run: python service.py [--host 127.0.0.1] [--port 8765] [--unix PATH] [--preload walk=stikman_walk.json]
+#
+# Every message is: 4-byte big-endian header length, UTF-8 JSON header, then header["nbytes"]
+# bytes of binary payload (0 if absent). Requests are headers only:
+#   {"op": "load", "scene": "walk", "name": "stikman_walk.json", "source": "examples" | "saved"}
+#   {"op": "list"}
+#   {"op": "bones", "scene": "walk"}
+#   {"op": "solve", "scene": "walk", "start": 0, "end": 100, "chunk": 256}
+# "solve" answers frames start..end-1 with one message per chunk, payload is a C-order
+# float32 array of shape header["shape"] = [frames, bones, 4] (x, y, angle, length),
+# bones in the order returned by "bones"; the last chunk has "more": false.
+# The range must lie inside the scene's frames 0..last.
+# The server accepts headers up to MAX_HEADER and request payloads up to MAX_REQUEST_PAYLOAD bytes;
+# a malformed message gets an error reply and the connection is closed.
+
+import argparse
+import asyncio
+import json
+import os
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import logging
+
+import core
+import storage
+
+logger = logging.getLogger(__name__)
+
+logger.debug('service.py run')
+file_id = 'service'
+
+DEFAULT_PORT = 8765
+MAX_CHUNK = 4096
+CACHE_CHUNKS = 64  # Solved chunks kept per scene / Решённых блоков на сцену
+MAX_HEADER = 1 << 16
+MAX_REQUEST_PAYLOAD = 1 << 20  # Requests carry no payload yet / Запросы пока без данных
+
+executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+logger.info(f'service ThreadPoolExecutor created | {file_id}')
+
+
+class LoadedScene:
+    def __init__(self, scene):
+        self.scene = scene
+        self.order = list(scene.hierarchy.order())
+        self.cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self.lock = threading.Lock()  # Chunks are solved on several workers / Блоки решаются в нескольких потоках
+
+    def solve_chunk(self, start, count) -> bytes:
+        key = (start, count)
+        with self.lock:
+            data = self.cache.get(key)
+            if data is not None:
+                self.cache.move_to_end(key)
+                return data
+        solved = self.scene.solve_frames(range(start, start + count))
+        data = np.ascontiguousarray(solved, dtype='<f4').tobytes()
+        with self.lock:
+            self.cache[key] = data
+            while len(self.cache) > CACHE_CHUNKS:
+                self.cache.popitem(last=False)
+        return data
+
+
+class PoseService:
+    """Keeps scenes loaded and answers batched solve requests from many clients."""
+
+    def __init__(self):
+        logger.info(f'initialization PoseService | {file_id}')
+        self.scenes = {}
+
+    def load(self, scene_id, name, source="saved"):
+        if os.path.basename(name) != name:
+            raise ValueError(f"bad file name {name}")
+        base = storage.EXAMPLES_DIR if source == "examples" else storage.STORAGE_DIR
+        scene = core.Scene()
+        scene._restore(storage.read_scene(os.path.join(base, name), name.endswith('.xml')))
+        self.scenes[scene_id] = LoadedScene(scene)
+        logger.info(f'scene {scene_id} loaded from {name} | {file_id}')
+        return self.scenes[scene_id]
+
+    def get(self, scene_id) -> LoadedScene:
+        if scene_id not in self.scenes:
+            raise KeyError(f"scene {scene_id} is not loaded")
+        return self.scenes[scene_id]
+
+    async def handle(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        logger.info(f'client connected {peer} | {file_id}')
+        try:
+            while True:
+                try:
+                    request, _ = await read_message(reader, MAX_REQUEST_PAYLOAD)
+                except asyncio.IncompleteReadError:
+                    break
+                except ValueError as e:
+                    # The stream can't be resynchronized after a bad message / Поток не восстановить
+                    logger.warning(f'bad message from {peer}: {e} | {file_id}')
+                    await write_message(writer, {"ok": False, "id": None, "error": str(e)})
+                    break
+                try:
+                    await self.dispatch(request, writer)
+                except Exception as e:
+                    logger.error(f'error in request {request.get("op")}: {e} | {file_id}')
+                    await write_message(writer, {"ok": False, "id": request.get("id"), "error": str(e)})
+        finally:
+            writer.close()
+            logger.info(f'client disconnected {peer} | {file_id}')
+
+    async def dispatch(self, request, writer):
+        op = request.get("op")
+        rid = request.get("id")
+        loop = asyncio.get_running_loop()
+        if op == "load":
+            loaded = await loop.run_in_executor(executor, self.load, request["scene"], request["name"],
+                                                request.get("source", "saved"))
+            await write_message(writer, {"ok": True, "id": rid, "bones": loaded.order,
+                                         "frames": max(loaded.scene.frames.keys()) + 1})
+        elif op == "list":
+            await write_message(writer, {"ok": True, "id": rid, "scenes": sorted(self.scenes)})
+        elif op == "bones":
+            loaded = self.get(request["scene"])
+            await write_message(writer, {"ok": True, "id": rid, "bones": loaded.order,
+                                         "parents": [loaded.scene.hierarchy.parent[b] for b in loaded.order]})
+        elif op == "solve":
+            loaded = self.get(request["scene"])
+            count = max(loaded.scene.frames.keys()) + 1
+            start = int(request.get("start", 0))
+            end = int(request.get("end", count))
+            chunk = max(1, min(int(request.get("chunk", 256)), MAX_CHUNK))
+            if end <= start:
+                raise ValueError("empty frame range")
+            if start < 0 or end > count:
+                raise ValueError(f"frame range {start}..{end} outside 0..{count}")
+            # Chunks are streamed as soon as they are solved / Блоки отправляются сразу после решения
+            for a in range(start, end, chunk):
+                count = min(chunk, end - a)
+                data = await loop.run_in_executor(executor, loaded.solve_chunk, a, count)
+                await write_message(writer, {"ok": True, "id": rid, "start": a, "count": count,
+                                             "shape": [count, len(loaded.order), 4], "dtype": "<f4",
+                                             "more": a + count < end}, data)
+        else:
+            raise ValueError(f"unknown op {op}")
+
+
+async def read_message(reader, max_payload=None):
+    """Header dict and payload bytes; ValueError on a malformed or oversized message."""
+    size = struct.unpack('>I', await reader.readexactly(4))[0]
+    if size > MAX_HEADER:
+        raise ValueError(f"header of {size} bytes exceeds {MAX_HEADER}")
+    header = json.loads((await reader.readexactly(size)).decode('utf-8'))
+    if not isinstance(header, dict):
+        raise ValueError("message header is not a JSON object")
+    nbytes = header.get("nbytes") or 0
+    if not isinstance(nbytes, int) or nbytes < 0 or (max_payload is not None and nbytes > max_payload):
+        raise ValueError(f"bad payload size {nbytes!r}")
+    payload = await reader.readexactly(nbytes) if nbytes else b""
+    return header, payload
+
+
+async def write_message(writer, header, payload=b""):
+    header = dict(header, nbytes=len(payload))
+    raw = json.dumps(header).encode('utf-8')
+    writer.write(struct.pack('>I', len(raw)) + raw + payload)
+    await writer.drain()
+
+
+async def fetch_frames(scene_id, start, end, host='127.0.0.1', port=DEFAULT_PORT, unix=None, chunk=256):
+    """Client helper: solved (frames, bones, 4) float32 array of frames start..end-1."""
+    if unix:
+        reader, writer = await asyncio.open_unix_connection(unix)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    try:
+        await write_message(writer, {"op": "solve", "scene": scene_id, "start": start, "end": end, "chunk": chunk})
+        parts = []
+        while True:
+            header, payload = await read_message(reader)
+            if not header.get("ok"):
+                raise RuntimeError(header.get("error"))
+            parts.append(np.frombuffer(payload, dtype=header["dtype"]).reshape(header["shape"]))
+            if not header["more"]:
+                return np.concatenate(parts)
+    finally:
+        writer.close()
+
+
+async def serve(host='127.0.0.1', port=DEFAULT_PORT, unix=None, preload=()):
+    service = PoseService()
+    for item in preload:
+        scene_id, _, name = item.partition('=')
+        service.load(scene_id, name or scene_id, "examples" if os.path.exists(
+            os.path.join(storage.EXAMPLES_DIR, name or scene_id)) else "saved")
+    if unix:
+        server = await asyncio.start_unix_server(service.handle, path=unix)
+    else:
+        server = await asyncio.start_server(service.handle, host=host, port=port)
+    logger.info(f'pose service listening on {unix or f"{host}:{port}"} | {file_id}')
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless pose evaluation service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', help="Unix socket path instead of TCP")
+    parser.add_argument('--preload', nargs='*', default=[], help="scene_id=file.json from examples or saves")
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level))
+    asyncio.run(serve(args.host, args.port, args.unix, args.preload))
@@ -0,0 +1,118 @@
+# /skinning.py
+# Linear blend skinning of mesh attachments / Линейное смешивание скининга для мешей
+
+from typing import Dict, List
+import numpy as np
+import logging
+
+import core
+
+logger = logging.getLogger(__name__)
+
+logger.debug('skinning.py run')
+file_id = 'skinning'
+
+# Max floats of the (frames, vertices, 2, 3) skin block held at once
+# Максимум чисел в блоке (кадры, вершины, 2, 3) одновременно
+CHUNK_FLOATS = 4_000_000
+
+
+def skin_matrices(world: np.ndarray, bind: np.ndarray) -> np.ndarray:
+    """world (..., B, 3) and bind (B, 3) -> world @ inverse(bind) as (..., B, 2, 3)."""
+    rad = np.radians(world[..., 2] - bind[:, 2])
+    c, s = np.cos(rad), np.sin(rad)
+    bx, by = bind[:, 0], bind[:, 1]
+    m = np.empty(world.shape[:-1] + (2, 3))
+    m[..., 0, 0] = c
+    m[..., 0, 1] = -s
+    m[..., 1, 0] = s
+    m[..., 1, 1] = c
+    m[..., 0, 2] = world[..., 0] - (c * bx - s * by)
+    m[..., 1, 2] = world[..., 1] - (s * bx + c * by)
+    return m
+
+
+def deform(att, world: np.ndarray) -> np.ndarray:
+    """Skin the attachment for all frames at once.
+
+    world is (F, B, 3) for the attachment's bone palette; returns (F, N, 2).
+    """
+    logger.debug(f'deform {att.name}, {len(att.vertices)} vertices, {len(world)} frames | {file_id}')
+    skin = skin_matrices(world, att.bind)
+    n = len(att.vertices)
+    out = np.zeros((len(world), n, 2))
+    step = max(1, CHUNK_FLOATS // max(1, n * 6))
+    for a in range(0, len(world), step):
+        block = skin[a:a + step]
+        acc = out[a:a + step]
+        for k in range(att.indices.shape[1]):
+            m = block[:, att.indices[:, k]]  # (f, N, 2, 3)
+            moved = np.einsum('fnij,nj->fni', m[..., :2], att.vertices) + m[..., 2]
+            acc += att.weights[None, :, k, None] * moved
+    return out
+
+
+def deform_scene(scene, frame_ids) -> Dict[str, np.ndarray]:
+    """Deformed vertices (F, N, 2) of every attachment in the scene."""
+    if not scene.attachments:
+        return {}
+    return deform_solved(scene, scene.solve_frames(frame_ids), scene.hierarchy.order())
+
+
+def deform_solved(scene, solved: np.ndarray, order) -> Dict[str, np.ndarray]:
+    """Same as deform_scene for already solved (F, B, 4) positions with bones in order."""
+    logger.info(f'deform scene attachments | {file_id}')
+    col = {b: i for i, b in enumerate(order)}
+    return {name: deform(a, solved[:, [col[b] for b in a.bones], :3]) for name, a in scene.attachments.items()}
+
+
+def auto_weights(vertices: np.ndarray, segments: np.ndarray, max_influences=4, falloff=2.0):
+    """Inverse-distance weights of vertices (N, 2) to bone segments (B, 4).
+
+    Returns (indices, weights), both (N, K) with K = min(max_influences, B).
+    """
+    a = segments[None, :, :2]
+    d = segments[None, :, 2:] - a
+    v = vertices[:, None, :]
+    ll = np.sum(d * d, axis=-1)
+    t = np.clip(np.sum((v - a) * d, axis=-1) / np.where(ll > 0, ll, 1.0), 0.0, 1.0)
+    dist = np.linalg.norm(a + t[..., None] * d - v, axis=-1)
+    k = min(max_influences, segments.shape[0])
+    idx = np.argsort(dist, axis=1)[:, :k]
+    w = 1.0 / (np.take_along_axis(dist, idx, axis=1) + 1e-3) ** falloff
+    w /= w.sum(axis=1, keepdims=True)
+    return idx, w
+
+
+def make_bone_mesh(scene, name, bone_id, frame_idx=0, width=20.0, rows=8, cols=3, color=(90, 140, 220, 255)):
+    """Grid mesh wrapped around bone_id at its pose in frame_idx.
+
+    The mesh is weighted to the bone, its parent and its children so joints bend smoothly.
+    """
+    logger.info(f'make mesh {name} on bone {bone_id} | {file_id}')
+    pos = scene.compute_abs_positions(frame_idx)
+    x, y, angle, length = pos[bone_id]
+    rad = np.radians(angle)
+    along = np.array([np.cos(rad), np.sin(rad)])
+    across = np.array([-along[1], along[0]])
+    u = np.linspace(0.0, max(length, 1.0), rows + 1)
+    v = np.linspace(-width / 2, width / 2, cols + 1)
+    uu, vv = np.meshgrid(u, v, indexing='ij')
+    vertices = np.array([x, y]) + uu.reshape(-1, 1) * along + vv.reshape(-1, 1) * across
+    tris: List[List[int]] = []
+    for r in range(rows):
+        for c in range(cols):
+            i = r * (cols + 1) + c
+            j = i + cols + 1
+            tris.append([i, j, i + 1])
+            tris.append([i + 1, j, j + 1])
+    bones = [bone_id] + scene.children(bone_id)
+    parent = scene.hierarchy.parent.get(bone_id)
+    if parent:
+        bones.append(parent)
+    bind = np.array([pos[b][:3] for b in bones], dtype=float)
+    seg = np.array([[p[0], p[1], p[0] + np.cos(np.radians(p[2])) * p[3], p[1] + np.sin(np.radians(p[2])) * p[3]]
+                    for p in (pos[b] for b in bones)], dtype=float)
+    indices, weights = auto_weights(vertices, seg)
+    return core.Attachment(name=name, vertices=vertices, triangles=tris, bones=bones,
+                           indices=indices, weights=weights, bind=bind, color=color)
@@ -0,0 +1,150 @@
+# /spatial.py
+# Spatial index for viewport picking / Пространственный индекс для выбора костей
+
+from typing import Dict, List, Optional, Tuple
+import math
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+logger.debug('spatial.py run')
+file_id = 'spatial'
+
+
+def segment_from_pos(pos):
+    # (x, y, angle, length) -> (x0, y0, x1, y1)
+    x, y, angle, length = pos[:4]
+    rad = math.radians(angle)
+    return (float(x), float(y), float(x + math.cos(rad) * length), float(y + math.sin(rad) * length))
+
+
+class SegmentGrid:
+    """Uniform grid over the solved bone segments of one frame.
+
+    Every segment is registered in all cells it passes through, so point and box
+    queries only look at the few cells around the query instead of all bones.
+    """
+
+    def __init__(self, cell_size=32.0):
+        logger.info(f'initialization SegmentGrid | {file_id}')
+        self.cell_size = float(cell_size)
+        self.cells: Dict[Tuple[int, int], set] = {}
+        self.segments: Dict[str, Tuple[float, float, float, float]] = {}
+        self.bone_cells: Dict[str, List[Tuple[int, int]]] = {}
+        self._source = None
+
+    def clear(self):
+        logger.debug(f'clear grid | {file_id}')
+        self.cells = {}
+        self.segments = {}
+        self.bone_cells = {}
+        self._source = None
+
+    def _cells_for(self, seg):
+        # All cells crossed by the segment (column by column supercover)
+        cs = self.cell_size
+        x0, y0, x1, y1 = seg
+        if x0 > x1:
+            x0, y0, x1, y1 = x1, y1, x0, y0
+        dx = x1 - x0
+        result = []
+        for cx in range(math.floor(x0 / cs), math.floor(x1 / cs) + 1):
+            if dx > 1e-9:
+                xa = max(x0, cx * cs)
+                xb = min(x1, (cx + 1) * cs)
+                ya = y0 + (y1 - y0) * (xa - x0) / dx
+                yb = y0 + (y1 - y0) * (xb - x0) / dx
+            else:
+                ya, yb = y0, y1
+            for cy in range(math.floor(min(ya, yb) / cs), math.floor(max(ya, yb) / cs) + 1):
+                result.append((cx, cy))
+        return result
+
+    def _insert(self, bid, seg):
+        cells = self._cells_for(seg)
+        for c in cells:
+            self.cells.setdefault(c, set()).add(bid)
+        self.segments[bid] = seg
+        self.bone_cells[bid] = cells
+
+    def _remove(self, bid):
+        for c in self.bone_cells.pop(bid, ()):
+            bucket = self.cells.get(c)
+            if bucket is not None:
+                bucket.discard(bid)
+                if not bucket:
+                    del self.cells[c]
+        self.segments.pop(bid, None)
+
+    def update(self, positions):
+        """Sync the grid with compute_abs_positions output, re-binning only changed bones."""
+        if positions is self._source:
+            logger.debug(f'grid up to date | {file_id}')
+            return 0
+        changed = 0
+        for bid in [b for b in self.segments if b not in positions]:
+            self._remove(bid)
+            changed += 1
+        for bid, pos in positions.items():
+            seg = segment_from_pos(pos)
+            if self.segments.get(bid) == seg:
+                continue
+            self._remove(bid)
+            self._insert(bid, seg)
+            changed += 1
+        self._source = positions
+        logger.debug(f'grid updated, {changed} bones re-binned | {file_id}')
+        return changed
+
+    def _candidates(self, x0, y0, x1, y1):
+        cs = self.cell_size
+        found = set()
+        for cx in range(math.floor(x0 / cs), math.floor(x1 / cs) + 1):
+            for cy in range(math.floor(y0 / cs), math.floor(y1 / cs) + 1):
+                bucket = self.cells.get((cx, cy))
+                if bucket:
+                    found.update(bucket)
+        return list(found)
+
+    def nearest(self, x, y, radius=8.0) -> Optional[str]:
+        """Closest bone whose segment lies within radius of (x, y), or None."""
+        ids = self._candidates(x - radius, y - radius, x + radius, y + radius)
+        if not ids:
+            return None
+        seg = np.array([self.segments[b] for b in ids], dtype=float)
+        ax, ay = seg[:, 0], seg[:, 1]
+        dx, dy = seg[:, 2] - ax, seg[:, 3] - ay
+        ll = dx * dx + dy * dy
+        t = np.where(ll > 0, ((x - ax) * dx + (y - ay) * dy) / np.where(ll > 0, ll, 1.0), 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        dist = np.hypot(ax + t * dx - x, ay + t * dy - y)
+        i = int(np.argmin(dist))
+        if dist[i] > radius:
+            return None
+        logger.debug(f'nearest bone {ids[i]} at {dist[i]:.2f} | {file_id}')
+        return ids[i]
+
+    def query_box(self, x0, y0, x1, y1) -> List[str]:
+        """Bones whose segment touches the rectangle (Liang-Barsky clip test)."""
+        xmin, xmax = min(x0, x1), max(x0, x1)
+        ymin, ymax = min(y0, y1), max(y0, y1)
+        ids = self._candidates(xmin, ymin, xmax, ymax)
+        if not ids:
+            return []
+        seg = np.array([self.segments[b] for b in ids], dtype=float)
+        sx, sy = seg[:, 0], seg[:, 1]
+        dx, dy = seg[:, 2] - sx, seg[:, 3] - sy
+        t0 = np.zeros(len(ids))
+        t1 = np.ones(len(ids))
+        ok = np.ones(len(ids), dtype=bool)
+        for p, q in ((-dx, sx - xmin), (dx, xmax - sx), (-dy, sy - ymin), (dy, ymax - sy)):
+            parallel = p == 0
+            ok &= ~(parallel & (q < 0))
+            r = np.where(parallel, 0.0, q / np.where(parallel, 1.0, p))
+            t0 = np.where(~parallel & (p < 0), np.maximum(t0, r), t0)
+            t1 = np.where(~parallel & (p > 0), np.minimum(t1, r), t1)
+        ok &= t0 <= t1
+        result = [b for b, hit in zip(ids, ok) if hit]
+        logger.debug(f'box select {len(result)} bones | {file_id}')
+        return result
@@ -3,9 +3,14 @@
 
 import json
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
 import logging
 
+import core
+import keyreduce
+
 logger = logging.getLogger(__name__)
 
 logger.debug('storage.py run')
@@ -20,6 +25,17 @@ try:
 except Exception as e:
     logger.error(f'error creating STORAGE_DIR: {e} | {file_id}')
 
+# mkstemp creates 0600 files, saves get the usual umask mode instead / Права файлов по umask
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+# Single worker keeps writes to the same file ordered / Один воркер сохраняет порядок записей
+io_executor = ThreadPoolExecutor(max_workers=1)
+logger.info(f'io ThreadPoolExecutor created | {file_id}')
+
+# Attachment arrays stored flat in XML, Attachment reshapes them back / Массивы вложений в XML хранятся плоско
+ATTACHMENT_ARRAYS = {"vertices": float, "triangles": int, "indices": int, "weights": float, "bind": float}
+
 def list_examples(extension='.json'):
     try:
         files = [f for f in os.listdir(EXAMPLES_DIR) if f.endswith(extension)]
@@ -29,19 +45,13 @@ def list_examples(extension='.json'):
         logger.error(f'error in list_examples: {e} | {file_id}')
         return []
 
-def load_example(name, scene, is_xml=False):
+def load_example(name, scene, is_xml=False, tolerance=None):
     path = os.path.join(EXAMPLES_DIR, name)
     try:
         if os.path.exists(path):
-            if is_xml:
-                return load_xml(path, scene)
-            else:
-                with open(path, 'r', encoding='utf-8') as f:
-                    loaded = json.load(f)
-                scene.push_undo()
-                scene._restore(loaded)
-                logger.info(f'loaded JSON example {name} | {file_id}')
-                return True
+            apply_loaded(scene, read_scene(path, is_xml), tolerance)
+            logger.info(f'loaded {"XML" if is_xml else "JSON"} example {name} | {file_id}')
+            return True
         logger.warning(f'example {name} not found | {file_id}')
         return False
     except Exception as e:
@@ -57,79 +67,204 @@ def list_saved(extension='.json'):
         logger.error(f'error in list_saved: {e} | {file_id}')
         return []
 
-def save_scene(name, scene, is_xml=False):
+# tolerance=(pos_tol, angle_tol) stores reduced keys in the file, the scene itself is untouched
+# tolerance=(pos_tol, angle_tol) сохраняет сокращённые ключи в файле, сама сцена не меняется
+def save_scene(name, scene, is_xml=False, tolerance=None):
+    return write_scene(name, scene.to_dict(), is_xml, tolerance)
+
+def save_scene_async(name, scene, is_xml=False, tolerance=None, progress=None):
+    # Snapshot is taken on the calling (UI) thread, the worker only sees the copy
+    # Снимок делается в вызывающем (UI) потоке, воркер работает только с копией
+    data = scene.to_dict()
+    logger.info(f'save scene {name} queued | {file_id}')
+    return io_executor.submit(write_scene, name, data, is_xml, tolerance, progress)
+
+def write_scene(name, data, is_xml=False, tolerance=None, progress=None):
+    report = progress or (lambda value: None)
     try:
+        report(0.1)
+        # Both formats store curves, so both can be reduced / Оба формата хранят кривые
+        if tolerance:
+            keyreduce.reduce_keys(data, *tolerance)
         if is_xml:
             path = os.path.join(STORAGE_DIR, f"{name}.xml")
-            save_xml(path, scene)
-            logger.info(f'saved XML to {path} | {file_id}')
-            return path
+            payload = xml_bytes(data)
         else:
             path = os.path.join(STORAGE_DIR, f"{name}.json")
-            with open(path, 'w', encoding='utf-8') as f:
-                json.dump(scene.to_dict(), f, ensure_ascii=False, indent=2)
-            logger.info(f'saved JSON to {path} | {file_id}')
-            return path
+            # Each distinct pose is written once / Каждая различная поза пишется один раз
+            data = dict(data, **core.pack_frames(data["frames"]))
+            payload = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+        report(0.5)
+        write_atomic(path, payload)
+        report(1.0)
+        logger.info(f'saved {"XML" if is_xml else "JSON"} to {path} | {file_id}')
+        return path
     except Exception as e:
         logger.error(f'error in save_scene {name}: {e} | {file_id}')
+        report(1.0)
         return None
 
-def load_saved(name, scene, is_xml=False):
+def write_atomic(path, payload):
+    # Temp file + fsync + rename: readers see either the old or the new file
+    # Временный файл + fsync + rename: читатель видит либо старый, либо новый файл
+    # Unique temp name, sync saves and the io worker may target the same file / Уникальное имя
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        os.chmod(tmp, 0o666 & ~UMASK)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    try:
+        dir_fd = os.open(os.path.dirname(path), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass  # Directories can't be fsynced on Windows / На Windows директории не синхронизируются
+    logger.debug(f'atomic write {path} | {file_id}')
+
+def read_scene(path, is_xml=False):
+    if is_xml:
+        return parse_xml(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def apply_loaded(scene, loaded, tolerance=None):
+    scene.push_undo()
+    scene._restore(loaded)
+    if tolerance:
+        scene.reduce_keys(*tolerance)
+
+def load_saved(name, scene, is_xml=False, tolerance=None):
     path = os.path.join(STORAGE_DIR, name)
     try:
         if os.path.exists(path):
-            if is_xml:
-                return load_xml(path, scene)
-            else:
-                with open(path, 'r', encoding='utf-8') as f:
-                    loaded = json.load(f)
-                scene.push_undo()
-                scene._restore(loaded)
-                logger.info(f'loaded saved JSON {name} | {file_id}')
-                return True
+            apply_loaded(scene, read_scene(path, is_xml), tolerance)
+            logger.info(f'loaded saved {"XML" if is_xml else "JSON"} {name} | {file_id}')
+            return True
         logger.warning(f'save {name} not found | {file_id}')
         return False
     except Exception as e:
         logger.error(f'error in load_saved {name}: {e} | {file_id}')
         return False
 
+def load_saved_async(name, is_xml=False):
+    # Result is the parsed state (or None), apply it with apply_loaded on the UI thread
+    # Результат - разобранное состояние (или None), применять через apply_loaded в UI потоке
+    path = os.path.join(STORAGE_DIR, name)
+
+    def worker():
+        try:
+            if not os.path.exists(path):
+                logger.warning(f'save {name} not found | {file_id}')
+                return None
+            loaded = read_scene(path, is_xml)
+            logger.info(f'parsed saved {name} | {file_id}')
+            return loaded
+        except Exception as e:
+            logger.error(f'error in load_saved_async {name}: {e} | {file_id}')
+            return None
+
+    logger.info(f'load {name} queued | {file_id}')
+    return io_executor.submit(worker)
+
 def load_xml(path, scene):
     try:
-        tree = etree.parse(path)
-        root = tree.getroot()
-        scene.name = root.get('name', 'unnamed')
-        scene.bones.clear()
-        scene.frames.clear()
-        for b in root.findall('.//bone'):
-            scene.bones[b.get('id')] = scene.Bone(
-                id=b.get('id'),
-                x=float(b.get('x', '0')),
-                y=float(b.get('y', '0')),
-                angle=float(b.get('angle', '0')),
-                length=float(b.get('length', '0')),
-                parent=b.get('parent')
-            )
-        for f in root.findall('.//frame'):
-            idx = int(f.get('index', '0'))
-            scene.frames[idx] = {}
-        scene.push_undo()
+        apply_loaded(scene, parse_xml(path))
         logger.info(f'loaded XML from {path} | {file_id}')
         return True
     except Exception as e:
         logger.error(f'error in load_xml {path}: {e} | {file_id}')
         return False
 
+def parse_xml(path):
+    root = etree.parse(path).getroot()
+    bones = {}
+    for b in root.findall('./bones/bone'):
+        bones[b.get('id')] = {
+            "id": b.get('id'),
+            "x": float(b.get('x', '0')),
+            "y": float(b.get('y', '0')),
+            "angle": float(b.get('angle', '0')),
+            "length": float(b.get('length', '0')),
+            "parent": b.get('parent') or None,
+            "constraints": [parse_constraint(c) for c in b.findall('constraint')],
+        }
+    poses = {p.get('id'): {o.get('bone'): {k: float(v) for k, v in o.attrib.items() if k != 'bone'}
+                           for o in p.findall('override')} for p in root.findall('.//pose')}
+    # Frames refer to shared poses, older files have none / Кадры ссылаются на общие позы, в старых файлах их нет
+    frames = {int(f.get('index', '0')): poses.get(f.get('pose'), {}) for f in root.findall('.//frame')}
+    curves = {}
+    for c in root.findall('.//curve'):
+        curves.setdefault(c.get('bone'), {})[c.get('channel')] = [
+            [int(k.get('frame')), float(k.get('value'))] for k in c.findall('key')]
+    attachments = {}
+    for a in root.findall('./attachments/attachment'):
+        att = {"name": a.get('name'), "bones": [b.get('id') for b in a.findall('bone')],
+               "color": [int(float(v)) for v in a.get('color', '').split()] or (90, 140, 220, 255)}
+        for key, kind in ATTACHMENT_ARRAYS.items():
+            att[key] = [kind(v) for v in (a.findtext(key) or '').split()]
+        attachments[att["name"]] = att
+    return {"name": root.get('name', 'unnamed'), "bones": bones, "frames": frames or {0: {}}, "curves": curves,
+            "attachments": attachments}
+
+def parse_constraint(elem):
+    # Attributes back to numbers and flags / Атрибуты обратно в числа и флаги
+    c = {}
+    for k, v in elem.attrib.items():
+        if k in ('type', 'target'):
+            c[k] = v
+        elif v in ('true', 'false'):
+            c[k] = v == 'true'
+        else:
+            c[k] = float(v)
+    return c
+
+def xml_bytes(data):
+    root = etree.Element("figure", name=data["name"])
+    bones_elem = etree.SubElement(root, "bones")
+    for bid, b in data["bones"].items():
+        bone_elem = etree.SubElement(bones_elem, "bone", id=bid, x=str(b["x"]), y=str(b["y"]),
+                                     angle=str(b["angle"]), length=str(b["length"]), parent=b["parent"] or "")
+        for c in b.get("constraints", []):
+            etree.SubElement(bone_elem, "constraint", {k: str(v).lower() if isinstance(v, bool) else str(v)
+                                                       for k, v in c.items()})
+    packed = core.pack_frames(data["frames"])
+    poses_elem = etree.SubElement(root, "poses")
+    for pid, pose in packed["poses"].items():
+        pose_elem = etree.SubElement(poses_elem, "pose", id=pid)
+        for bid, overrides in pose.items():
+            etree.SubElement(pose_elem, "override", bone=bid, **{c: str(v) for c, v in overrides.items()})
+    frames_elem = etree.SubElement(root, "frames")
+    for idx, pid in packed["frames"].items():
+        etree.SubElement(frames_elem, "frame", index=str(idx), pose=pid)
+    # Reduced keys live only in curves / Сокращённые ключи хранятся только в кривых
+    curves_elem = etree.SubElement(root, "curves")
+    for bid, channels in data.get("curves", {}).items():
+        for channel, keys in channels.items():
+            curve_elem = etree.SubElement(curves_elem, "curve", bone=bid, channel=channel)
+            for frame, value in keys:
+                etree.SubElement(curve_elem, "key", frame=str(frame), value=str(value))
+    attachments_elem = etree.SubElement(root, "attachments")
+    for name, a in data.get("attachments", {}).items():
+        att_elem = etree.SubElement(attachments_elem, "attachment", name=name,
+                                    color=" ".join(str(v) for v in a["color"]))
+        for bid in a["bones"]:
+            etree.SubElement(att_elem, "bone", id=bid)
+        for key in ATTACHMENT_ARRAYS:
+            etree.SubElement(att_elem, key).text = " ".join(str(v) for row in a[key] for v in row)
+    return etree.tostring(root, pretty_print=True, xml_declaration=True, encoding="utf-8")
+
 def save_xml(path, scene):
     try:
-        root = etree.Element("figure", name=scene.name)
-        bones_elem = etree.SubElement(root, "bones")
-        for bid, b in scene.bones.items():
-            etree.SubElement(bones_elem, "bone", id=bid, x=str(b.x), y=str(b.y), angle=str(b.angle), length=str(b.length), parent=b.parent or "")
-        frames_elem = etree.SubElement(root, "frames")
-        for idx in sorted(scene.frames.keys()):
-            frame_elem = etree.SubElement(frames_elem, "frame", index=str(idx))
-        tree = etree.ElementTree(root)
-        tree.write(path, pretty_print=True, xml_declaration=True, encoding="utf-8")
+        write_atomic(path, xml_bytes(scene.to_dict()))
         logger.info(f'saved XML to {path} | {file_id}')
     except Exception as e:
-        logger.error(f'error in save_xml {path}: {e} | {file_id}')
\ No newline at end of file
+        logger.error(f'error in save_xml {path}: {e} | {file_id}')
@@ -0,0 +1,91 @@
+# /thumbnails.py
+# Timeline thumbnails / Миниатюры таймлайна
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+import numpy as np
+from PIL import Image, ImageDraw
+import logging
+
+logger = logging.getLogger(__name__)
+
+logger.debug('thumbnails.py run')
+file_id = 'thumbnails'
+
+THUMB_SIZE = (64, 64)
+VIEW_SIZE = (500, 500)  # Scene area shown in a thumbnail / Область сцены в миниатюре
+
+executor = ThreadPoolExecutor(max_workers=2)
+logger.info(f'thumbnails ThreadPoolExecutor created | {file_id}')
+
+
+def segments(pos: np.ndarray) -> np.ndarray:
+    """Bone segments (F, B, 4) of solved (F, B, 4) positions."""
+    rad = np.radians(pos[..., 2])
+    ends = pos[..., :2] + pos[..., 3:4] * np.stack([np.cos(rad), np.sin(rad)], axis=-1)
+    return np.concatenate([pos[..., :2], ends], axis=-1)
+
+
+def render_batch(solve, size=THUMB_SIZE) -> List[np.ndarray]:
+    # Runs on the worker: one batched solve, then one raster per frame / В воркере: один пакетный расчёт
+    return [rasterize(seg, size) for seg in segments(solve())]
+
+
+def rasterize(segments: np.ndarray, size=THUMB_SIZE, view_size=VIEW_SIZE) -> np.ndarray:
+    """Flat float32 RGBA pixels in the layout dearpygui dynamic textures expect."""
+    img = Image.new('RGBA', size, (255, 255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    scaled = segments * np.array([size[0] / view_size[0], size[1] / view_size[1]] * 2)
+    for x0, y0, x1, y1 in scaled.tolist():
+        draw.line((x0, y0, x1, y1), fill=(0, 0, 0, 255), width=1)
+    return (np.asarray(img, dtype=np.float32) / 255.0).ravel()
+
+
+class ThumbnailCache:
+    """LRU of rasterized thumbnails keyed by (frame, frame revision).
+
+    An edit bumps the revision of the frames it touches, so only those frames miss
+    the cache; stale entries are never hit again and age out.
+    """
+
+    def __init__(self, capacity=512, size=THUMB_SIZE):
+        logger.info(f'initialization ThumbnailCache | {file_id}')
+        self.capacity = capacity
+        self.size = size
+        self.items: "OrderedDict[Tuple[int, int], np.ndarray]" = OrderedDict()
+        self.pending: Dict[Tuple[int, int], Tuple[object, int]] = {}  # key -> (batch future, index)
+        # Shown for frames whose render failed, so they are not resubmitted / Для кадров с ошибкой рендера
+        self.placeholder = np.ones(size[0] * size[1] * 4, dtype=np.float32)
+
+    def get(self, key):
+        pixels = self.items.get(key)
+        if pixels is not None:
+            self.items.move_to_end(key)
+        return pixels
+
+    def request(self, scene, frame_ids) -> List[Tuple[int, int]]:
+        """Queue background rendering of frames not cached yet, returns their keys."""
+        keys = [(f, scene.frame_revision(f)) for f in frame_ids]
+        missing = [k for k in keys if k not in self.items and k not in self.pending]
+        if missing:
+            logger.debug(f'render {len(missing)} thumbnails | {file_id}')
+            # Frames are sampled here, solved and drawn on the worker / Выборка здесь, решение и отрисовка в воркере
+            fut = executor.submit(render_batch, scene.solve_frames_later([k[0] for k in missing]), self.size)
+            for i, key in enumerate(missing):
+                self.pending[key] = (fut, i)
+        return keys
+
+    def poll(self) -> int:
+        """Move finished renders into the cache, returns how many arrived."""
+        done = [k for k, (fut, _) in self.pending.items() if fut.done()]
+        for key in done:
+            fut, i = self.pending.pop(key)
+            try:
+                self.items[key] = fut.result()[i]
+            except Exception as e:
+                logger.error(f'error rendering thumbnail {key}: {e} | {file_id}')
+                self.items[key] = self.placeholder
+        while len(self.items) > self.capacity:
+            self.items.popitem(last=False)
+        return len(done)
@@ -0,0 +1,131 @@
+# /uimodel.py
+# UI model with dirty tracking / Модель UI с отслеживанием изменений
+
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+logger.debug('uimodel.py run')
+file_id = 'uimodel'
+
+_MISSING = object()
+
+
+class UIModel:
+    """Remembers what every widget shows so only changed values reach dearpygui.
+
+    Parts of the UI are marked dirty explicitly (mark) or by a change of a
+    revision token (changed); widgets are written through set/configure, which
+    skip values equal to the last written ones.
+    """
+
+    def __init__(self, set_value: Callable, configure_item: Callable):
+        logger.info(f'initialization UIModel | {file_id}')
+        self._set_value = set_value
+        self._configure_item = configure_item
+        self.values: Dict[str, object] = {}
+        self.options: Dict[Tuple[str, str], object] = {}
+        self.tokens: Dict[str, object] = {}
+        self.dirty: Set[str] = set()
+
+    def mark(self, *parts):
+        self.dirty.update(parts)
+
+    def take(self, part) -> bool:
+        """True once after part was marked dirty."""
+        if part in self.dirty:
+            self.dirty.discard(part)
+            return True
+        return False
+
+    def changed(self, part, token) -> bool:
+        """True when token differs from the one seen last time (or part is marked dirty)."""
+        if self.take(part) or self.tokens.get(part, _MISSING) != token:
+            self.tokens[part] = token
+            return True
+        return False
+
+    def set(self, tag, value) -> bool:
+        if self.values.get(tag, _MISSING) == value:
+            return False
+        self._set_value(tag, value)
+        self.values[tag] = value
+        return True
+
+    def configure(self, tag, **kwargs) -> bool:
+        todo = {k: v for k, v in kwargs.items() if self.options.get((tag, k), _MISSING) != v}
+        if not todo:
+            return False
+        self._configure_item(tag, **todo)
+        for k, v in todo.items():
+            self.options[(tag, k)] = v
+        return True
+
+    def forget(self, tag):
+        # Widget was changed by the user, next set must write / Виджет изменён пользователем
+        self.values.pop(tag, None)
+
+
+class BoneTreeView:
+    """Flattened, filterable view of the bone hierarchy of which only a window of rows is drawn."""
+
+    def __init__(self, rows=12):
+        logger.info(f'initialization BoneTreeView | {file_id}')
+        self.rows = rows
+        self.filter = ""
+        self.collapsed: Set[str] = set()
+        self.offset = 0
+        self.items: List[Tuple[str, int, bool]] = []  # (bone id, depth, has children)
+        self._token = None
+        self._version = 0
+
+    def set_filter(self, text):
+        self.filter = text or ""
+        self.offset = 0
+        self._version += 1
+
+    def toggle(self, bid):
+        if bid in self.collapsed:
+            self.collapsed.discard(bid)
+        else:
+            self.collapsed.add(bid)
+        self._version += 1
+
+    def refresh(self, scene) -> bool:
+        """Rebuild the flattened list if the hierarchy or the view options changed."""
+        h = scene.hierarchy
+        token = (h.revision, self._version)
+        if token == self._token:
+            return False
+        order = h.order()
+        items = []
+        if self.filter:
+            needle = self.filter.lower()
+            items = [(b, h.depth[b], bool(h.children[b])) for b in order if needle in b.lower()]
+        else:
+            # Collapsed subtrees are skipped by range, not walked / Свёрнутые поддеревья пропускаются целиком
+            i = 0
+            while i < len(order):
+                bid = order[i]
+                items.append((bid, h.depth[bid], bool(h.children[bid])))
+                i = h.subtree_range(bid)[1] if bid in self.collapsed else i + 1
+        self.items = items
+        self.offset = max(0, min(self.offset, len(items) - self.rows))
+        self._token = token
+        logger.debug(f'bone tree rebuilt, {len(items)} rows | {file_id}')
+        return True
+
+    def max_offset(self) -> int:
+        return max(0, len(self.items) - self.rows)
+
+    def window(self) -> List[Optional[Tuple[str, int, bool]]]:
+        rows = self.items[self.offset:self.offset + self.rows]
+        return rows + [None] * (self.rows - len(rows))
+
+    def reveal(self, bid):
+        for i, item in enumerate(self.items):
+            if item[0] == bid:
+                if not self.offset <= i < self.offset + self.rows:
+                    self.offset = max(0, min(i - self.rows // 2, self.max_offset()))
+                return